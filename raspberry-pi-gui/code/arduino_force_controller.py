@@ -4,15 +4,36 @@ import threading
 import serial
 import time
 import re
+import selectors
+from collections import deque
 from typing import Callable, Optional
 import logging
 from enum import Enum
 
+import numpy as np
+
 # Configure module-level logger
 logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
 logger = logging.getLogger(__name__)
 
 LINE_RE = re.compile(r"F(?P<force>[-\d\.]+)\s+S(?P<steps>-?\d+)")
+SWEEP_BUFFER_SIZE = 4096  # initial reading capacity; doubles when full
+
+
+def _parse_reading(line: str):
+    """Parse an 'F<force> S<steps>' data line into (force, steps), or None."""
+    # Fast path for the fixed format the firmware prints; the regex is only
+    # needed for lines that do not split cleanly
+    head, sep, tail = line.partition(" S")
+    if sep and head.startswith("F"):
+        try:
+            return float(head[1:]), int(tail)
+        except ValueError:
+            pass
+    m = LINE_RE.match(line)
+    if m:
+        return float(m.group("force")), int(m.group("steps"))
+    return None
 
 class ArduinoErrorType(Enum):
     """Types of errors that can occur with Arduino communication"""
@@ -23,6 +44,16 @@ class ArduinoErrorType(Enum):
     ENDSTOP_HIT = "ENDSTOP_HIT"
     MAX_FORCE_EXCEEDED = "MAX_FORCE_EXCEEDED"
 
+# Error lines the firmware prints, with the error type and log message for each
+_ERROR_MAP = {
+    "FORCEERROR": (ArduinoErrorType.FORCE_SENSOR_ERROR,
+                   "Arduino reported force sensor error - sensor communication failed"),
+    "I2CTIMEOUT": (ArduinoErrorType.I2C_TIMEOUT,
+                   "Arduino reported I2C timeout - force sensor not responding"),
+    "FAIL": (ArduinoErrorType.GENERAL_FAIL,
+             "Arduino reported general failure - endstop hit or max force exceeded"),
+}
+
 class ArduinoState:
     """Track the current state of the Arduino"""
     def __init__(self):
@@ -39,7 +70,14 @@ class ArduinoForceController:
         self.on_reading = on_reading
         self.on_error = on_error  # New callback for error handling
         self._stop = threading.Event()
-        self._last_line = ""
+        self._recent_lines = deque(maxlen=8)  # most recent lines, newest last
+        self._rxbuf = bytearray()
+        self._log_interval = 0.2  # seconds between logged force/step readings
+        self._last_log_t = 0.0
+        # Every reading of the connection, kept as arrays for the analysis
+        self._sweep_force = np.empty(SWEEP_BUFFER_SIZE, dtype=np.float64)
+        self._sweep_steps = np.empty(SWEEP_BUFFER_SIZE, dtype=np.int64)
+        self._sweep_len = 0
         self.ser = None
         self._thread = None
         self.logger = logging.getLogger(self.__class__.__name__)
@@ -55,13 +93,13 @@ class ArduinoForceController:
                 # Clean up any existing connection first
                 self._cleanup_serial()
                 
-                self.logger.info(f"Attempting to connect to Arduino on {self.port} (attempt {attempt + 1}/{max_retries})")
+                self.logger.info("Attempting to connect to Arduino on %s (attempt %s/%s)", self.port, attempt + 1, max_retries)
                 
                 # Open serial connection
                 self.ser = serial.Serial(
                     port=self.port,
                     baudrate=9600,  # Arduino expects 9600 baud
-                    timeout=3.0,    # Restore original timeout
+                    timeout=0,      # Non-blocking; the read loop polls the port
                     write_timeout=1.0
                 )
                 
@@ -71,6 +109,7 @@ class ArduinoForceController:
                 # Clear any stale data in buffers
                 self.ser.reset_input_buffer()
                 self.ser.reset_output_buffer()
+                self._rxbuf = bytearray()
                 
                 # Start reading thread
                 self._thread = threading.Thread(target=self._read_loop, daemon=True)
@@ -78,27 +117,29 @@ class ArduinoForceController:
                 
                 self.state.is_connected = True
                 self.state.consecutive_errors = 0
-                self.logger.info(f"Successfully connected to Arduino on {self.port}")
+                self.logger.info("Successfully connected to Arduino on %s", self.port)
                 return
                 
             except serial.SerialException as e:
-                self.logger.warning(f"Serial connection attempt {attempt + 1} failed: {e}")
+                self.logger.warning("Serial connection attempt %s failed: %s", attempt + 1, e)
                 if attempt == max_retries - 1:
-                    self.logger.error(f"Failed to connect to Arduino after {max_retries} attempts")
+                    self.logger.error("Failed to connect to Arduino after %s attempts", max_retries)
                     self.state.is_connected = False
                     raise ConnectionError(f"Could not connect to Arduino on {self.port}: {e}")
                 time.sleep(1)  # Wait before retry
     
     def _cleanup_serial(self):
         """Clean up existing serial connection."""
-        if hasattr(self, 'ser') and self.ser and self.ser.is_open:
+        ser = getattr(self, 'ser', None)
+        if ser and ser.is_open:
             try:
                 self.ser.close()
                 self.logger.info("Closed existing serial connection")
             except Exception as e:
-                self.logger.warning(f"Error closing existing serial connection: {e}")
+                self.logger.warning("Error closing existing serial connection: %s", e)
         
-        if hasattr(self, '_thread') and self._thread and self._thread.is_alive():
+        thread = getattr(self, '_thread', None)
+        if thread and thread.is_alive():
             self._stop.set()
             self._thread.join(timeout=2)
             if self._thread.is_alive():
@@ -113,78 +154,131 @@ class ArduinoForceController:
         if self._thread and self._thread.is_alive():
             self._thread.join(timeout=3)
         
+        # A new connection starts a new sweep; the old readings would
+        # otherwise be prepended to it in get_sweep_arrays
+        self._sweep_len = 0
+
         # Clear stop event and reinitialize
         self._stop.clear()
         self._init_serial_connection()
 
     def _handle_error_message(self, line: str):
         """Handle error messages from Arduino"""
-        error_type = ArduinoErrorType.NONE
-        
-        if line == "FORCEERROR":
-            error_type = ArduinoErrorType.FORCE_SENSOR_ERROR
-            self.logger.error("Arduino reported force sensor error - sensor communication failed")
-        elif line == "I2CTIMEOUT":
-            error_type = ArduinoErrorType.I2C_TIMEOUT
-            self.logger.error("Arduino reported I2C timeout - force sensor not responding")
-        elif line == "FAIL":
-            error_type = ArduinoErrorType.GENERAL_FAIL
-            self.logger.error("Arduino reported general failure - endstop hit or max force exceeded")
-        
-        if error_type != ArduinoErrorType.NONE:
-            self.state.last_error = error_type
-            self.state.error_count += 1
-            self.state.consecutive_errors += 1
-            
-            # Call error callback if provided
-            if self.on_error:
-                self.on_error(error_type, line)
-            
-            self.logger.warning(f"Arduino error: {error_type.value}, consecutive errors: {self.state.consecutive_errors}")
+        entry = _ERROR_MAP.get(line)
+        if entry is None:
+            return
+        error_type, message = entry
+        self.logger.error(message)
+
+        self.state.last_error = error_type
+        self.state.error_count += 1
+        self.state.consecutive_errors += 1
+
+        # Call error callback if provided
+        if self.on_error:
+            self.on_error(error_type, line)
+
+        self.logger.warning("Arduino error: %s, consecutive errors: %s", error_type.value, self.state.consecutive_errors)
 
     def _read_loop(self):
-        while not self._stop.is_set():
-            try:
-                line = self.ser.readline().decode(errors="ignore").strip()
-                if line:
-                    # Check for error messages first
-                    if line in ["FORCEERROR", "I2CTIMEOUT", "FAIL"]:
-                        self._handle_error_message(line)
-                        self._last_line = line
+        # Wait for the port to become readable in short ticks instead of
+        # blocking inside read(), so a stop request is seen within 100 ms
+        sel = selectors.DefaultSelector()
+        try:
+            sel.register(self.ser.fileno(), selectors.EVENT_READ)
+        except (AttributeError, OSError, ValueError):
+            # No pollable descriptor on this platform: use timed reads instead
+            sel.close()
+            sel = None
+            self.ser.timeout = 0.1
+
+        try:
+            while not self._stop.is_set():
+                try:
+                    if sel is not None and not sel.select(timeout=0.1):
                         continue
-                    
-                    # Check for startup message
-                    if line == "STARTUP":
-                        self.logger.info("Arduino startup detected")
-                        self._last_line = line
+                    # Read everything that is waiting in one call instead of
+                    # letting readline() pull the line in byte by byte
+                    chunk = self.ser.read(self.ser.in_waiting or 1)
+                    if not chunk:
                         continue
-                    
-                    # Try to parse force/position data
-                    m = LINE_RE.match(line)
-                    if m:
-                        f = float(m.group("force"))
-                        s = int(m.group("steps"))
-                        
-                        # Update state
-                        self.state.last_force = f
-                        self.state.last_position = s
-                        self.state.consecutive_errors = 0  # Reset on successful reading
-                        
-                        # Log every force and step reading
-                        self.logger.info("Force: %.3f N, Steps: %d", f, s)
-                        if self.on_reading:
-                            self.on_reading(f, s)
-                    else:
-                        # Debug log for unparsed lines (might be START, ERROR, etc.)
-                        self.logger.debug("Unparsed line from serial: %s", line)
-                    
-                    self._last_line = line
-            except Exception as e:
-                self.logger.error(f"Error in read loop: {e}")
-                break
+                    self._rxbuf += chunk
+                    if b"\n" not in chunk:
+                        continue
+                    lines = self._rxbuf.split(b"\n")
+                    self._rxbuf = lines.pop()  # keep trailing partial line
+                    for raw in lines:
+                        line = raw.decode(errors="ignore").strip()
+                        if line:
+                            self._handle_line(line)
+                except Exception as e:
+                    self.logger.error("Error in read loop: %s", e)
+                    break
+        finally:
+            if sel is not None:
+                sel.close()
         
         self.logger.info("Arduino read loop stopped")
 
+    def _handle_line(self, line: str):
+        """Process one complete line received from the Arduino."""
+        # Check for error messages first
+        if line in _ERROR_MAP:
+            self._handle_error_message(line)
+            self._recent_lines.append(line)
+            return
+        
+        # Check for startup message
+        if line == "STARTUP":
+            self.logger.info("Arduino startup detected")
+            self._recent_lines.append(line)
+            return
+        
+        # Try to parse force/position data
+        reading = _parse_reading(line)
+        if reading is not None:
+            f, s = reading
+            
+            # Update state
+            self.state.last_force = f
+            self.state.last_position = s
+            self.state.consecutive_errors = 0  # Reset on successful reading
+            self._record_reading(f, s)
+            
+            # Log force and step readings, rate-limited so a fast stream
+            # does not turn the read thread into a logging thread
+            now = time.monotonic()
+            if (now - self._last_log_t >= self._log_interval and
+                    self.logger.isEnabledFor(logging.INFO)):
+                self._last_log_t = now
+                self.logger.info("Force: %.3f N, Steps: %d", f, s)
+            if self.on_reading:
+                self.on_reading(f, s)
+        elif self.logger.isEnabledFor(logging.DEBUG):
+            # Debug log for unparsed lines (might be START, ERROR, etc.)
+            self.logger.debug("Unparsed line from serial: %s", line)
+        
+        self._recent_lines.append(line)
+
+    def _record_reading(self, force: float, steps: int):
+        """Append a reading to the sweep buffers, growing them when full."""
+        n = self._sweep_len
+        if n == len(self._sweep_force):
+            self._sweep_force = np.resize(self._sweep_force, 2 * n)
+            self._sweep_steps = np.resize(self._sweep_steps, 2 * n)
+        self._sweep_force[n] = force
+        self._sweep_steps[n] = steps
+        self._sweep_len = n + 1
+
+    def get_sweep_arrays(self):
+        """Return (force_N, steps) arrays of all readings received so far.
+
+        The arrays are copies, so they stay valid while the read loop keeps
+        appending.
+        """
+        n = self._sweep_len
+        return self._sweep_force[:n].copy(), self._sweep_steps[:n].copy()
+
     def move_to_force(self, force: float, delay_s: int):
         """Send move to force command with error handling."""
         if not self.ser or not self.ser.is_open:
@@ -192,15 +286,16 @@ class ArduinoForceController:
             
         try:
             cmd = f"MOVETOFORCE {force:.2f} {delay_s}\n"
+            # write() hands the bytes to the OS, which sends them at line rate;
+            # no flush() here, it would block until the UART has drained
             self.ser.write(cmd.encode())
-            self.ser.flush()  # Ensure command is sent immediately
-            self.logger.info(f"Sent command: {cmd.strip()}")
+            self.logger.info("Sent command: %s", cmd.strip())
         except serial.SerialException as e:
-            self.logger.error(f"Error sending command: {e}")
+            self.logger.error("Error sending command: %s", e)
             raise ConnectionError(f"Failed to send command to Arduino: {e}")
 
     def get_last_reading(self) -> str:
-        return self._last_line
+        return self._recent_lines[-1] if self._recent_lines else ""
 
     def get_state(self) -> ArduinoState:
         """Get current Arduino state"""
@@ -229,10 +324,11 @@ class ArduinoForceController:
             
         if self.ser and self.ser.is_open:
             try:
+                self.ser.flush()  # Make sure a queued command goes out before closing
                 self.ser.close()
                 self.logger.info("Arduino connection closed successfully")
             except Exception as e:
-                self.logger.warning(f"Error closing serial connection: {e}")
+                self.logger.warning("Error closing serial connection: %s", e)
         
         self.state.is_connected = False
 
@@ -244,10 +340,10 @@ class ArduinoForceController:
         try:
             self.move_to_force(target_force, hold_seconds)
         except Exception as e:
-            self.logger.warning(f"Dummy measurement failed: {e}")
+            self.logger.warning("Dummy measurement failed: %s", e)
             # Try to reset connection if dummy measurement fails
             try:
                 self.reset_connection()
                 self.move_to_force(target_force, hold_seconds)
             except Exception as e2:
-                self.logger.error(f"Dummy measurement failed even after reset: {e2}")
+                self.logger.error("Dummy measurement failed even after reset: %s", e2)
@@ -1,6 +1,195 @@
+import functools
+
 import numpy as np
 import pandas as pd
-from scipy.signal import savgol_filter
+
+
+@functools.lru_cache(maxsize=32)
+def _savgol_operator(window, polyorder):
+    """Return the Savitzky-Golay smoothing operator for (window, polyorder).
+
+    This is the (window, window) matrix scipy's savgol_filter applies to an
+    array of exactly `window` samples: the middle row is the FIR kernel used
+    for all interior samples, the first and last window // 2 rows are the
+    polynomial edge fits of its default 'interp' mode. All of them come out
+    of the least-squares projection onto polynomials of degree polyorder,
+    built here with NumPy so scipy.signal is not imported at startup.
+    """
+    if polyorder >= window:
+        raise ValueError("polyorder must be less than window_length.")
+    half = window // 2
+    # Positions scaled to [-1, 1] keep the Vandermonde matrix well conditioned
+    positions = (np.arange(window, dtype=np.float64) - half) / max(half, 1)
+    vander = np.vander(positions, polyorder + 1, increasing=True)
+    operator = vander @ np.linalg.pinv(vander)
+    operator.flags.writeable = False  # shared by every caller through the cache
+    return operator
+
+
+# Build the operator for the default smoothing parameters at import; fallback
+# windows for short sweeps are built on first use and cached
+_savgol_operator(31, 3)
+
+
+def _savgol_smooth(force, operator, out=None):
+    """Smooth force with a precomputed operator, matching savgol_filter.
+
+    The operator differs from scipy's in the last bits, so where the smoothed
+    gradient has exact ties (force rounded to 0 or 1 decimals) the extrema
+    can land on another index. For the firmware's 3-decimal force values the
+    step/flush indices are identical; test_diameter_extractor.py pins them.
+    The result is written to out (length len(force)) when given.
+    """
+    window = len(operator)
+    n = len(force)
+    if window > n:
+        raise ValueError("window_length must be less than or equal to the size of x")
+    half = window // 2
+    smoothed = np.empty(n, dtype=np.float64) if out is None else out
+    smoothed[half:n - half] = np.correlate(force, operator[half], mode='valid')
+    np.matmul(operator[:half], force[:window], out=smoothed[:half])
+    np.matmul(operator[window - half:], force[n - window:], out=smoothed[n - half:])
+    return smoothed
+
+
+def _gradient_extrema(smoothed, out=None):
+    """Return (argmax, argmin) of np.gradient(smoothed) without building it.
+
+    Works on twice the gradient (central differences without the halving)
+    so the one-sided end differences can be compared exactly; ties resolve
+    to the first index, as with np.argmax / np.argmin. out, if given, is
+    scratch space of length len(smoothed) - 2.
+    """
+    n = len(smoothed)
+    diff = np.subtract(smoothed[2:], smoothed[:-2], out=out)
+    first = 2.0 * (smoothed[1] - smoothed[0])
+    last = 2.0 * (smoothed[n - 1] - smoothed[n - 2])
+
+    i_max = int(np.argmax(diff))
+    i_min = int(np.argmin(diff))
+    g_max, g_min = diff[i_max], diff[i_min]
+    i_max, i_min = i_max + 1, i_min + 1
+
+    if first >= g_max:
+        i_max, g_max = 0, first
+    if last > g_max:
+        i_max = n - 1
+    if first <= g_min:
+        i_min, g_min = 0, first
+    if last < g_min:
+        i_min = n - 1
+    return i_max, i_min
+
+
+def _count_crossings(force, threshold):
+    """Count how often a force array crosses threshold, up or down.
+
+    A sample exactly at the threshold is neither above nor below it, so
+    6.0 -> 5.5 -> 6.0 is one crossing, not two or none. Forces come in with
+    three decimals, so 5.500 readings are common; sign-bit tricks on
+    force - threshold treat 0.0 as positive and would count differently.
+    """
+    prev, curr = force[:-1], force[1:]
+    return int(
+        np.count_nonzero((prev <= threshold) & (curr > threshold)) +
+        np.count_nonzero((prev >= threshold) & (curr < threshold))
+    )
+
+
+def _step_flush_kernel(force, smoothing_window, polyorder, work=None):
+    """Return (step_idx, relative_flush_idx) of a force array.
+
+    The step and flush are the steepest rise and fall of the smoothed force.
+    work, if given, is a (2, >= len(force)) float64 scratch array that holds
+    the smoothed force and its differences instead of fresh allocations.
+    """
+    operator = _savgol_operator(smoothing_window, polyorder)
+    if work is None:
+        return _gradient_extrema(_savgol_smooth(force, operator))
+    n = len(force)
+    smoothed = _savgol_smooth(force, operator, out=work[0, :n])
+    return _gradient_extrema(smoothed, out=work[1, :max(n - 2, 0)])
+
+
+def _step_flush_indices(force, index_max, smoothing_window=31, polyorder=3,
+                        work=None):
+    """Return (step_idx, flush_idx, relative_flush_idx) for a validated force array."""
+    # Ensure smoothing window is appropriate for data size
+    data_length = len(force)
+    if smoothing_window >= data_length:
+        smoothing_window = max(5, data_length // 2)
+        if smoothing_window % 2 == 0:  # Must be odd
+            smoothing_window -= 1
+
+    try:
+        step_idx, relative_flush_idx = _step_flush_kernel(
+            force, smoothing_window, polyorder, work
+        )
+        flush_idx = index_max - relative_flush_idx
+        return step_idx, flush_idx, relative_flush_idx
+    except Exception as e:
+        # If smoothing fails, return safe defaults
+        print(f"Warning: Error in step/flush index calculation: {e}")
+        return 0, data_length // 2, data_length // 2
+
+
+def _analyze_sweep(force, deflection, index_max, threshold=5.5, work=None):
+    """Compute all numeric features of a validated sweep in one call.
+
+    Returns:
+        tuple: (step_idx, flush_idx, relative_flush_idx, intersections, drift)
+    """
+    step_idx, flush_idx, relative_flush_idx = _step_flush_indices(
+        force, index_max, work=work
+    )
+    intersections = _count_crossings(force, threshold)
+    drift = abs(deflection[-1] - deflection[0])
+    return step_idx, flush_idx, relative_flush_idx, intersections, drift
+
+
+def _index_max(index):
+    """Return index.max(), reading it off directly for a RangeIndex."""
+    # DataFrames built from the CSV have a RangeIndex, whose maximum is its
+    # last element when the step is positive; anything else gets the scan
+    if isinstance(index, pd.RangeIndex) and index.step > 0 and len(index):
+        return index[-1]
+    return index.max()
+
+
+def _check_length(n, validation_flags, validation_info):
+    """Flag empty or too short sweeps; return False if the sweep is unusable."""
+    if n == 0:
+        validation_flags.append('NO_DATA')
+        validation_info['NO_DATA'] = 'No force data available'
+        return False
+    if n < 10:
+        validation_flags.append('INSUFFICIENT_DATA')
+        validation_info['INSUFFICIENT_DATA'] = f'Only {n} data points'
+        return False
+    return True
+
+
+def _check_force_values(force_values, validation_flags, validation_info):
+    """Run the force range checks; return False if the values are unusable."""
+    # All values are negative exactly when the maximum is, so one
+    # reduction serves both this and the excessive-force check below
+    max_force = force_values.max()
+    if max_force < 0:
+        validation_flags.append('INVALID_FORCE')
+        validation_info['INVALID_FORCE'] = 'All force values are negative (sensor error)'
+        return False
+
+    # Check for constant force (stuck sensor)
+    force_std = np.std(force_values)
+    if force_std < 0.01:  # Very low variation
+        validation_flags.append('STUCK_SENSOR')
+        validation_info['STUCK_SENSOR'] = f'Force variation too low: {force_std:.4f}'
+
+    # Check for reasonable force range
+    if max_force > 20:  # Unreasonably high force
+        validation_flags.append('EXCESSIVE_FORCE')
+        validation_info['EXCESSIVE_FORCE'] = f'Maximum force: {max_force:.2f}N'
+    return True
 
 
 class DiameterExtractor:
@@ -12,6 +201,15 @@ class DiameterExtractor:
         self.zero_offset_mm = 0.0  # Zero offset from calibration
         self.calibration_scaling = -1.5e-02  # Default scaling factor
         self.is_calibrated = False
+        # Scratch space for the smoothed force and its differences, grown to
+        # the longest sweep seen and reused for every analysis after that
+        self._work = np.empty((2, 0), dtype=np.float64)
+
+    def _work_buffer(self, n):
+        """Return scratch space for a sweep of n samples, growing it if needed."""
+        if self._work.shape[1] < n:
+            self._work = np.empty((2, n), dtype=np.float64)
+        return self._work
 
     def set_calibration(self, known_diameter_mm, measured_flush_idx):
         """Set calibration parameters based on a known reference object.
@@ -35,6 +233,34 @@ class DiameterExtractor:
         self.zero_offset_mm = zero_offset_mm
         self.is_calibrated = True
 
+    def calibrate(self, force, deflection, known_diameter_mm):
+        """Calibrate on a reference sweep, analysing the data only once.
+
+        Takes the same in-memory arrays as diameter_from_arrays, so the zero
+        offset is derived from exactly the data it is later applied to.
+
+        Args:
+            force (np.ndarray): Force readings of the reference sweep in N.
+            deflection (np.ndarray): Deflection readings in mm, same length.
+            known_diameter_mm (float): Known diameter of the reference object.
+
+        Returns:
+            tuple: (diameter before calibration, list of flag strings, list of
+            flaginfo dictionaries, diameter after calibration)
+        """
+        diameter, flags, flaginfo, features = self._analyze_arrays(force, deflection)
+        flush_idx = features[1] if features is not None else 0
+        self.set_calibration(known_diameter_mm, flush_idx)
+        if features is not None:
+            calibrated_diameter = self.diameter_from_flush_idx(flush_idx)
+        else:
+            calibrated_diameter = 0.0
+        return diameter, flags, flaginfo, calibrated_diameter
+
+    def diameter_from_flush_idx(self, flush_idx):
+        """Convert a flush index to a diameter using the current calibration."""
+        return flush_idx * self.calibration_scaling + self.zero_offset_mm
+
     def validate_force_data(self, force_data):
         """Validate force-deflection data for measurement quality.
         
@@ -44,38 +270,34 @@ class DiameterExtractor:
         Returns:
             tuple: (is_valid, validation_flags, validation_info)
         """
+        is_valid, validation_flags, validation_info, _ = self._validate(force_data)
+        return is_valid, validation_flags, validation_info
+
+    def _validate(self, force_data):
+        """Validate force data and hand back the extracted force array.
+
+        Returns:
+            tuple: (is_valid, validation_flags, validation_info, force) where
+            force is the 'force_N' column as a float64 array, or None if
+            validation stopped before it was extracted.
+        """
         validation_flags = []
         validation_info = {}
         
         if force_data is None or force_data.empty:
-            validation_flags.append('NO_DATA')
-            validation_info['NO_DATA'] = 'No force data available'
-            return False, validation_flags, validation_info
+            _check_length(0, validation_flags, validation_info)
+            return False, validation_flags, validation_info, None
         
         # Check for minimum data points
-        if len(force_data) < 10:
-            validation_flags.append('INSUFFICIENT_DATA')
-            validation_info['INSUFFICIENT_DATA'] = f'Only {len(force_data)} data points'
-            return False, validation_flags, validation_info
+        if not _check_length(len(force_data), validation_flags, validation_info):
+            return False, validation_flags, validation_info, None
         
         # Check for valid force range
-        force_values = force_data['force_N'].values
-        if np.all(force_values < 0):
-            validation_flags.append('INVALID_FORCE')
-            validation_info['INVALID_FORCE'] = 'All force values are negative (sensor error)'
-            return False, validation_flags, validation_info
-        
-        # Check for constant force (stuck sensor)
-        force_std = np.std(force_values)
-        if force_std < 0.01:  # Very low variation
-            validation_flags.append('STUCK_SENSOR')
-            validation_info['STUCK_SENSOR'] = f'Force variation too low: {force_std:.4f}'
-        
-        # Check for reasonable force range
-        max_force = np.max(force_values)
-        if max_force > 20:  # Unreasonably high force
-            validation_flags.append('EXCESSIVE_FORCE')
-            validation_info['EXCESSIVE_FORCE'] = f'Maximum force: {max_force:.2f}N'
+        force_values = np.ascontiguousarray(
+            force_data['force_N'].to_numpy(dtype=np.float64)
+        )
+        if not _check_force_values(force_values, validation_flags, validation_info):
+            return False, validation_flags, validation_info, force_values
         
         # Check for missing columns
         required_columns = ['force_N', 'deflection_mm']
@@ -83,11 +305,24 @@ class DiameterExtractor:
         if missing_cols:
             validation_flags.append('MISSING_COLUMNS')
             validation_info['MISSING_COLUMNS'] = f'Missing: {missing_cols}'
-            return False, validation_flags, validation_info
+            return False, validation_flags, validation_info, force_values
         
         # Data seems valid if we get here
         is_valid = len(validation_flags) == 0
-        return is_valid, validation_flags, validation_info
+        return is_valid, validation_flags, validation_info, force_values
+
+    def _validate_arrays(self, force):
+        """Validate a force array with the same checks as a DataFrame.
+
+        Returns:
+            tuple: (is_valid, validation_flags, validation_info)
+        """
+        validation_flags = []
+        validation_info = {}
+        if (not _check_length(len(force), validation_flags, validation_info) or
+                not _check_force_values(force, validation_flags, validation_info)):
+            return False, validation_flags, validation_info
+        return len(validation_flags) == 0, validation_flags, validation_info
 
     def get_step_flush_indices(
         self, force_data, smoothing_window=31, polyorder=3
@@ -106,31 +341,15 @@ class DiameterExtractor:
             tuple: (step_idx, flush_idx, relative_flush_idx)
         """
         # Validate data first
-        is_valid, _, _ = self.validate_force_data(force_data)
+        is_valid, _, _, force = self._validate(force_data)
         if not is_valid:
             # Return safe default values for invalid data
             return 0, 0, 0
-        
-        force = force_data['force_N'].to_numpy()
-        
-        # Ensure smoothing window is appropriate for data size
-        data_length = len(force)
-        if smoothing_window >= data_length:
-            smoothing_window = max(5, data_length // 2)
-            if smoothing_window % 2 == 0:  # Must be odd
-                smoothing_window -= 1
-        
-        try:
-            smoothed = savgol_filter(force, window_length=smoothing_window, polyorder=polyorder)
-            gradient = np.gradient(smoothed)
-            step_idx = np.argmax(gradient)
-            relative_flush_idx = np.argmin(gradient)
-            flush_idx = force_data.index.max() - relative_flush_idx
-            return step_idx, flush_idx, relative_flush_idx
-        except Exception as e:
-            # If smoothing fails, return safe defaults
-            print(f"Warning: Error in step/flush index calculation: {e}")
-            return 0, len(force) // 2, len(force) // 2
+
+        return _step_flush_indices(
+            force, _index_max(force_data.index), smoothing_window, polyorder,
+            self._work_buffer(len(force))
+        )
 
     def diameter_from_force_data(self, force_data):
         """
@@ -145,41 +364,92 @@ class DiameterExtractor:
             tuple: (calculated_diameter, list of flag strings, list of flaginfo
             dictionaries)
         """
-        flags = []
-        flaginfo = {}
+        return self._analyze_frame(force_data)[:3]
 
-        # Validate data first
-        is_valid, validation_flags, validation_info = self.validate_force_data(force_data)
+    def analyze(self, force_data):
+        """
+        Diameter, flags and the step/flush indices of one sweep in a single
+        analysis pass.
+
+        Args:
+            force_data (pd.DataFrame): DataFrame containing force sweep
+            measurements with 'force_N' and 'deflection_mm' columns.
+
+        Returns:
+            tuple: (calculated_diameter, list of flag strings, list of flaginfo
+            dictionaries, step_idx, flush_idx)
+        """
+        diameter, flags, flaginfo, features = self._analyze_frame(force_data)
+        if features is None:
+            return diameter, flags, flaginfo, 0, 0
+        return diameter, flags, flaginfo, features[0], features[1]
+
+    def _analyze_frame(self, force_data):
+        """Validate a DataFrame and run one analysis pass over it.
+
+        Returns:
+            tuple: (calculated_diameter, list of flag strings, list of flaginfo
+            dictionaries, _analyze_sweep features or None for invalid data)
+        """
+        is_valid, validation_flags, validation_info, force = self._validate(force_data)
         if not is_valid:
-            flags.extend(validation_flags)
-            flaginfo.update(validation_info)
             # Return default diameter for invalid data
-            return 0.0, flags, [flaginfo]
+            return 0.0, validation_flags, [validation_info], None
+
+        # Crossings, drift and the flush index all come from one analysis
+        # of the already extracted arrays (default smoothing parameters)
+        deflection = force_data['deflection_mm'].to_numpy(dtype=np.float64)
+        features = _analyze_sweep(
+            force, deflection, _index_max(force_data.index),
+            work=self._work_buffer(len(force))
+        )
+        return (*self._diameter_from_features(features, validation_flags, validation_info),
+                features)
+
+    def diameter_from_arrays(self, force, deflection):
+        """
+        Same as diameter_from_force_data, for force and deflection arrays
+        taken straight from the measurement (no DataFrame needed).
+
+        Args:
+            force (np.ndarray): Force readings in N.
+            deflection (np.ndarray): Deflection readings in mm, same length.
+
+        Returns:
+            tuple: (calculated_diameter, list of flag strings, list of flaginfo
+            dictionaries)
+        """
+        return self._analyze_arrays(force, deflection)[:3]
+
+    def _analyze_arrays(self, force, deflection):
+        """Array counterpart of _analyze_frame, with the same return value."""
+        force = np.ascontiguousarray(force, dtype=np.float64)
+        is_valid, validation_flags, validation_info = self._validate_arrays(force)
+        if not is_valid:
+            # Return default diameter for invalid data
+            return 0.0, validation_flags, [validation_info], None
+
+        deflection = np.asarray(deflection, dtype=np.float64)
+        features = _analyze_sweep(
+            force, deflection, len(force) - 1, work=self._work_buffer(len(force))
+        )
+        return (*self._diameter_from_features(features, validation_flags, validation_info),
+                features)
+
+    def _diameter_from_features(self, features, validation_flags, validation_info):
+        """Turn _analyze_sweep output of a valid sweep into (diameter, flags, [flaginfo])."""
+        _, flush_idx, _, intersections, drift = features
 
         # Add validation flags as warnings even if data is valid
-        if validation_flags:
-            flags.extend(validation_flags)
-            flaginfo.update(validation_info)
+        flags = list(validation_flags)
+        flaginfo = dict(validation_info)
 
         # Check 5.5N intersections by finding where force crosses 5.5N threshold
-        force_array = force_data['force_N'].values
-        intersections = 0
-        for i in range(len(force_array) - 1):
-            if (
-                (force_array[i] <= 5.5 and force_array[i + 1] > 5.5) or
-                (force_array[i] >= 5.5 and force_array[i + 1] < 5.5)
-            ):
-                intersections += 1
-
         if intersections != 2:
             flags.append('MIP')
             flaginfo['MIP'] = f'MIP:{intersections}'
 
         # Check stepper drift
-        start_pos = force_data['deflection_mm'].iloc[0]
-        end_pos = force_data['deflection_mm'].iloc[-1]
-        drift = abs(end_pos - start_pos)
-
         if drift > 0.05:  # 0.025mm threshold
             flags.append('LSD')
             flaginfo['LSD'] = f'LSD:{drift:.3f}mm'
@@ -187,15 +457,11 @@ class DiameterExtractor:
             flags.append('MSD')
             flaginfo['MSD'] = f'MSD:{drift:.3f}mm'
 
-        # Calculate flush index using smoothed data
-        # Note: Using default smoothing parameters here
-        _, flush_idx, _ = self.get_step_flush_indices(force_data)
-
         # Convert flush index to diameter
         # The flush_idx represents the position where the force drops off
         # We need to convert this to a physical diameter measurement
         # This should be calibrated using known reference objects
-        calculated_diameter = flush_idx * self.calibration_scaling + self.zero_offset_mm
+        calculated_diameter = self.diameter_from_flush_idx(flush_idx)
 
         # Add calibration warning if not calibrated
         if not self.is_calibrated:
@@ -11,27 +11,143 @@ from tkinter import ttk, messagebox
 from datetime import datetime as dt
 import json
 import logging
-import traceback
-import math
-import pandas as pd
+from logging.handlers import MemoryHandler, RotatingFileHandler
+import re
 import time
-import csv
-import matplotlib.dates as mdates
 import numpy as np
-import matplotlib.pyplot as plt
 
 # Ensure local modules are on the path
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, SCRIPT_DIR)
+PARENT_DIR = os.path.dirname(SCRIPT_DIR)
+CAL_PATH = os.path.join(PARENT_DIR, "calibration", "calibration_10-500khz.cal")
 
 from motor_test import MeasurementProtocol, OUTPUT_DIR
 from nanovna import NanoVnaController
-from motor_test import plot_force_deflection
+from motor_test import plot_force_deflection, read_s21_db, replot
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.figure import Figure
 from diameter_extractor import DiameterExtractor
 from arduino_force_controller import ArduinoErrorType
 
+# OUTPUT_DIR plus a trailing separator, so per-measurement file names can be
+# built with a plain f-string instead of os.path.join
+_OUTPUT_PREFIX = os.path.join(OUTPUT_DIR, "")
+
+# USB serial adapters the Arduino may show up as: Arduino, CH340, FTDI
+ARDUINO_VIDS = frozenset({0x2341, 0x1A86, 0x0403})
+ARDUINO_DESC_KEYWORDS = ('arduino', 'ch340', 'usb serial')
+ARDUINO_DEVICE_PREFIXES = ('/dev/ttyACM', '/dev/ttyUSB')
+
+UI_FONT = ("Arial", 16)
+INPUT_FONT = ("Arial", 14)
+STATUS_FONT = ("Arial", 12)
+# Button option sets shared by the widgets built in _build_ui
+_STEP_BTN_KW = dict(width=2, padding=[5, 1])  # the small -/+ buttons
+_ACTION_BTN_KW = dict(padding=[12, 8])  # Single / 3 Reps
+_BAR_BTN_KW = dict(padding=[8, 3])  # bottom button bar
+
+# ISO timestamps as written by _update_metadata (datetime.isoformat())
+_TS_RE = re.compile(r"(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})")
+
+# Style of the flag labels drawn on the force plot (Text copies the bbox dict)
+_FLAG_TEXT_KW = dict(color='red', verticalalignment='top',
+                     bbox=dict(facecolor='white', alpha=0.7))
+
+# Placeholder curves shown before the first measurement
+_DUMMY_TIME = np.arange(100)
+_DUMMY_FORCE = _DUMMY_TIME * 0.1 + np.sin(_DUMMY_TIME / 5.0)
+_DUMMY_FREQ = np.arange(10, 1001, 10)  # 100 points from 10 to 1000 kHz
+_DUMMY_S21 = -20 * np.exp(-0.01 * (_DUMMY_FREQ - 500) ** 2) + 10  # Example S21 data
+
+# How long closing the window waits for a stopped sequence to wind down (s);
+# a VNA sweep in progress has to finish before the worker sees the stop
+_WORKER_JOIN_TIMEOUT = 30.0
+
+
+def _make_button(parent, text, command, button_kw=_BAR_BTN_KW, **kw):
+    """Create a ttk.Button with one of the shared option sets."""
+    return ttk.Button(parent, text=text, command=command, **button_kw, **kw)
+
+
+def _iso_to_tag(ts_iso):
+    """Turn an ISO timestamp into the YYYYmmdd_HHMMSS tag used in file names."""
+    m = _TS_RE.match(ts_iso)
+    if m is None:  # not the usual layout; let datetime parse it
+        return dt.fromisoformat(ts_iso).strftime("%Y%m%d_%H%M%S")
+    return f"{m[1]}{m[2]}{m[3]}_{m[4]}{m[5]}{m[6]}"
+
+
+def _tag_to_iso(tag):
+    """Inverse of _iso_to_tag: YYYYmmdd_HHMMSS to YYYY-mm-ddTHH:MM:SS."""
+    if len(tag) != 15 or tag[8] != "_":  # not a tag we wrote; parse it strictly
+        return dt.strptime(tag, "%Y%m%d_%H%M%S").isoformat()
+    return f"{tag[0:4]}-{tag[4:6]}-{tag[6:8]}T{tag[9:11]}:{tag[11:13]}:{tag[13:15]}"
+
+
+def _file_kb(path):
+    """Return the size of path as e.g. '12.3KB', or 'N/A' if it does not exist."""
+    try:
+        return f"{os.stat(path).st_size/1024:.1f}KB"
+    except OSError:
+        return "N/A"
+
+
+def _note_repetition(rep_index, entry):
+    """Raise rep_index[object_id] to the repetition of a log entry if higher."""
+    props = entry.get('us_properties', {})
+    object_id = props.get('object_id')
+    rep = int(props.get('repetition', 0))
+    if rep > rep_index.get(object_id, 0):
+        rep_index[object_id] = rep
+
+
+def _remove_if_exists(path):
+    """Delete path; return False instead of raising if it is already gone."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def _iter_lines_reversed(f, chunk_size=65536):
+    """Yield the non-blank lines of binary file f, last line first."""
+    pos = f.seek(0, os.SEEK_END)
+    head = b""
+    while pos > 0:
+        step = min(chunk_size, pos)
+        pos -= step
+        f.seek(pos)
+        lines = (f.read(step) + head).split(b"\n")
+        head = lines[0]  # may continue in the chunk before this one
+        for line in reversed(lines[1:]):
+            if line.strip():
+                yield line
+    if head.strip():
+        yield head
+
+
+def _find_last_line(f, chunk_size=4096):
+    """Return (offset, line) of the last non-empty line of binary file f.
+
+    Reads backwards from the end in chunks, so the cost does not depend on
+    the file length. Returns (None, None) for a file without lines.
+    """
+    pos = f.seek(0, os.SEEK_END)
+    buf = b""
+    while pos > 0:
+        step = min(chunk_size, pos)
+        pos -= step
+        f.seek(pos)
+        buf = f.read(step) + buf
+        body = buf.rstrip(b"\r\n")
+        nl = body.rfind(b"\n")
+        if nl >= 0:
+            return pos + nl + 1, body[nl + 1:]
+    body = buf.rstrip(b"\r\n")
+    return (0, body) if body else (None, None)
+
 class MeasurementApp(tk.Tk):
     def __init__(self):
         super().__init__()
@@ -48,8 +164,27 @@ class MeasurementApp(tk.Tk):
         self.protocol = None
         self.vna_ctrl = None
         self.measure_thread = None
+        self._serial_reset_thread = None
         self.stop_event = threading.Event()
+        self._closing = False
         self.metadata_file = os.path.join(OUTPUT_DIR, "metadata.json")
+        # One JSON object per line, appended per measurement (see README)
+        self.log_file = os.path.join(OUTPUT_DIR, "measurement_log.jsonl")
+        self._log_fp = None  # append handle, opened on the first entry
+        # Parsed metadata.json and the (mtime_ns, size) it was read at
+        self._meta_cache = None
+        self._meta_stamp = None
+        # Highest repetition per object_id in the log, and the log's stamp
+        self._rep_index = None
+        self._rep_stamp = None
+        # Log entries and input settings not yet written; a sequence queues
+        # them and writes them together when it ends
+        self._pending_log = []
+        self._pending_settings = None
+        self._batch_metadata = False
+        # Held while the queue is changed and while it is written out, so a
+        # flush from destroy() and one from the measurement thread cannot mix
+        self._metadata_lock = threading.Lock()
         self.diameter_extractor = DiameterExtractor()
         
         # Calibration state
@@ -59,11 +194,7 @@ class MeasurementApp(tk.Tk):
         # Error tracking
         self.current_errors = []
         self.last_arduino_state = None
-
-        # Matplotlib figure and axes
-        self.fig = Figure()
-        self.ax_force, self.ax_s21 = self.fig.subplots(1, 2)
-        self.canvas = FigureCanvasTkAgg(self.fig, master=self)
+        self._layout_dirty = True  # cleared once _update_plot has laid out real data
 
         # —— Logging Setup ——
         self.logger = logging.getLogger(self.__class__.__name__)
@@ -71,49 +202,63 @@ class MeasurementApp(tk.Tk):
         fmt = logging.Formatter(
             "%(asctime)s - %(levelname)s - ""%(message)s", "%Y-%m-%d %H:%M:%S"
         )
-        log_file_handler = logging.FileHandler("gui.log")
+        # Rotate instead of truncating, and buffer records so routine INFO
+        # lines reach the SD card in batches; warnings flush immediately
+        log_file_handler = RotatingFileHandler(
+            os.path.join(SCRIPT_DIR, "gui.log"), maxBytes=1 << 20, backupCount=2, delay=True
+        )
         log_file_handler.setFormatter(fmt)
-        self.logger.addHandler(log_file_handler)
+        try:
+            if os.stat(log_file_handler.baseFilename).st_size:
+                log_file_handler.doRollover()
+        except OSError:
+            pass
+        self._log_buffer = MemoryHandler(50, flushLevel=logging.WARNING, target=log_file_handler)
+        self.logger.addHandler(self._log_buffer)
         # Also log to console for immediate feedback during development
         self.logger.addHandler(logging.StreamHandler())
 
         # Configure ttk styles for fonts
         self.style = ttk.Style()
-        self.style.configure("TLabel", font=("Arial", 16))
-        self.style.configure("TButton", font=("Arial", 16))
-        self.style.configure("TEntry", font=("Arial", 16))
-        self.style.configure("TCombobox", font=("Arial", 16))
+        for widget_style in ("TLabel", "TButton", "TEntry", "TCombobox"):
+            self.style.configure(widget_style, font=UI_FONT)
         
         # Error status styles
-        self.style.configure("Error.TLabel", font=("Arial", 12), foreground="red")
-        self.style.configure("Warning.TLabel", font=("Arial", 12), foreground="orange")
-        self.style.configure("Success.TLabel", font=("Arial", 12), foreground="green")
+        for status_style, colour in (("Error.TLabel", "red"),
+                                     ("Warning.TLabel", "orange"),
+                                     ("Success.TLabel", "green")):
+            self.style.configure(status_style, font=STATUS_FONT, foreground=colour)
 
         self._clear_log_files()
         # self._cleanup_serial_connections()  # Temporarily disabled - might interfere with connection
+        self._migrate_measurement_log()
         self._load_input_settings()
         # Remove the old zero offset notice - we'll use calibration instead
         self._build_ui()
         self._update_last_measurement_label()
         
-        # Show calibration notice
+        # Show calibration notice once the main window has been drawn; a modal
+        # dialog here would hold back the first paint until it is dismissed
+        self.after_idle(self._show_calibration_notice)
+
+    def _show_calibration_notice(self):
         messagebox.showinfo(
             "Calibration Required",
             "Please place a 12.05mm PMMA cylinder in the sensor and click 'Calibrate' before taking measurements."
         )
 
     def _clear_log_files(self):
-        log_files = ["gui.log", "nanovna.log", "error.log"]
-        script_dir = os.path.dirname(os.path.abspath(__file__))
+        # gui.log is rotated by its handler in __init__
+        log_files = ["nanovna.log", "error.log"]
         for log_file_name in log_files:
-            log_path = os.path.join(script_dir, log_file_name)
-            if os.path.exists(log_path):
-                try:
-                    with open(log_path, "w") as f:
-                        f.truncate(0)
-                    # Note: We can't use self.logger here as it's not yet fully configured
-                except Exception as e:
-                    print(f"Error clearing {log_file_name}: {e}") # Use print for early errors
+            log_path = os.path.join(SCRIPT_DIR, log_file_name)
+            try:
+                os.truncate(log_path, 0)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                # Note: We can't use self.logger here as it's not yet fully configured
+                print(f"Error clearing {log_file_name}: {e}") # Use print for early errors
 
     def _cleanup_serial_connections(self):
         """Clean up any stale serial connections that might be blocking."""
@@ -126,21 +271,19 @@ class MeasurementApp(tk.Tk):
         arduino_ports = []
         
         for port in ports:
-            # Look for Arduino-like devices (common VID/PID combinations)
-            if (port.vid and port.pid and 
-                (port.vid in [0x2341, 0x1A86, 0x0403] or  # Arduino, CH340, FTDI
-                 'arduino' in (port.description or "").lower() or
-                 'ch340' in (port.description or "").lower() or
-                 'usb serial' in (port.description or "").lower())):
-                arduino_ports.append(port.device)
-            # Also check for common Linux Arduino ports
-            elif port.device.startswith('/dev/ttyACM') or port.device.startswith('/dev/ttyUSB'):
+            desc = (port.description or "").lower()
+            # Look for Arduino-like devices (common VID/PID combinations),
+            # and also accept the common Linux Arduino device names
+            if ((port.vid and port.pid and
+                 (port.vid in ARDUINO_VIDS or
+                  any(k in desc for k in ARDUINO_DESC_KEYWORDS))) or
+                    port.device.startswith(ARDUINO_DEVICE_PREFIXES)):
                 arduino_ports.append(port.device)
         
         # Try to reset each potential Arduino port
         for port_name in arduino_ports:
             try:
-                self.logger.info(f"Attempting to reset port: {port_name}")
+                self.logger.info("Attempting to reset port: %s", port_name)
                 
                 # Open and immediately close to reset the connection
                 ser = serial.Serial(port_name, 115200, timeout=0.5)
@@ -148,29 +291,141 @@ class MeasurementApp(tk.Tk):
                 ser.reset_output_buffer()
                 ser.close()
                 
-                self.logger.info(f"Successfully reset port: {port_name}")
+                self.logger.info("Successfully reset port: %s", port_name)
                 
             except Exception as e:
-                self.logger.warning(f"Could not reset port {port_name}: {e}")
+                self.logger.warning("Could not reset port %s: %s", port_name, e)
         
         # Small delay to let ports settle
         import time
         time.sleep(1)
 
+    def _get_metadata(self):
+        """Return the parsed metadata.json, or None if it does not exist.
+
+        The file is only re-read when its mtime or size changed. The returned
+        dict is the cached object: callers that modify it must save it with
+        _save_metadata (or drop it with _invalidate_metadata on failure).
+        """
+        try:
+            st = os.stat(self.metadata_file)
+        except FileNotFoundError:
+            self._invalidate_metadata()
+            return None
+        stamp = (st.st_mtime_ns, st.st_size)
+        if stamp != self._meta_stamp:
+            with open(self.metadata_file, 'r') as f:
+                self._meta_cache = json.load(f)
+            self._meta_stamp = stamp
+        return self._meta_cache
+
+    def _save_metadata(self, metadata):
+        """Write metadata.json and keep the cache in step with it."""
+        tmp = self.metadata_file + ".tmp"
+        try:
+            # Replace atomically so a crash mid-write can't truncate the file
+            with open(tmp, 'w') as f:
+                json.dump(metadata, f, indent=4)
+            os.replace(tmp, self.metadata_file)
+            st = os.stat(self.metadata_file)
+        except Exception:
+            self._invalidate_metadata()
+            raise
+        self._meta_cache = metadata
+        self._meta_stamp = (st.st_mtime_ns, st.st_size)
+
+    def _invalidate_metadata(self):
+        """Forget the cached metadata so the next read goes to disk."""
+        self._meta_cache = None
+        self._meta_stamp = None
+
+    def _migrate_measurement_log(self):
+        """Move a measurement_log array out of metadata.json into the JSONL log.
+
+        Older versions kept every measurement in metadata.json, which then
+        had to be rewritten in full for each new entry.
+        """
+        try:
+            metadata = self._get_metadata()
+            if not metadata or 'measurement_log' not in metadata:
+                return
+            entries = metadata['measurement_log']
+            try:
+                with open(self.log_file, 'rb') as f:
+                    existing = f.read()
+            except FileNotFoundError:
+                existing = b""
+            # A crash after the log was replaced but before metadata.json was
+            # saved leaves the entries in both; don't copy them a second time
+            logged = {json.loads(line).get('us_properties', {}).get('timestamp')
+                      for line in existing.splitlines() if line.strip()}
+            entries = [entry for entry in entries
+                       if entry.get('us_properties', {}).get('timestamp') not in logged]
+            tmp = self.log_file + ".tmp"
+            with open(tmp, 'wb') as f:
+                for entry in entries:
+                    f.write(json.dumps(entry, separators=(',', ':')).encode() + b"\n")
+                f.write(existing)
+            os.replace(tmp, self.log_file)
+            del metadata['measurement_log']
+            self._save_metadata(metadata)
+            self.logger.info("Moved %s measurement log entries to %s", len(entries), self.log_file)
+        except Exception:
+            self._invalidate_metadata()
+            self.logger.exception("Error migrating measurement log")
+
+    def _read_last_log_entry(self):
+        """Return the newest measurement log entry, or None if there is none."""
+        try:
+            with open(self.log_file, 'rb') as f:
+                _, line = _find_last_line(f)
+        except FileNotFoundError:
+            return None
+        return json.loads(line) if line else None
+
+    def _append_log_entries(self, entries):
+        """Append entries to the measurement log in a single write."""
+        f = self._log_fp
+        before = os.fstat(f.fileno()) if f else None
+        if before is None or before.st_nlink == 0:
+            # First entry, or the log was deleted or replaced since
+            if f:
+                f.close()
+            f = self._log_fp = open(self.log_file, 'a', buffering=1)
+            before = os.fstat(f.fileno())
+        f.write("".join(json.dumps(entry, separators=(',', ':')) + "\n" for entry in entries))
+        after = os.fstat(f.fileno())
+        # Keep the repetition index current instead of re-reading the log,
+        # unless the file had already changed behind our back
+        if self._rep_index is not None and self._rep_stamp == (before.st_mtime_ns, before.st_size):
+            for entry in entries:
+                _note_repetition(self._rep_index, entry)
+            self._rep_stamp = (after.st_mtime_ns, after.st_size)
+
+    def _iter_log_entries(self):
+        """Yield all measurement log entries, oldest first."""
+        try:
+            f = open(self.log_file, 'r')
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
     def _load_input_settings(self):
         """Load input settings from metadata.json input_settings"""
         self.zero_distance_mm = 13.45 # Default value, updated by user's last edit
         try:
-            if os.path.exists(self.metadata_file):
-                with open(self.metadata_file, 'r') as f:
-                    metadata = json.load(f)
+            metadata = self._get_metadata()
+            if metadata is not None:
                 input_settings = metadata.get('input_settings', {})
                 self.zero_distance_mm = float(input_settings.get('zero_distance_mm', self.zero_distance_mm))
-                self.logger.info(f"Loaded zero_distance_mm: {self.zero_distance_mm}")
+                self.logger.info("Loaded zero_distance_mm: %s", self.zero_distance_mm)
             else:
-                self.logger.warning(f"Metadata file not found: {self.metadata_file}")
+                self.logger.warning("Metadata file not found: %s", self.metadata_file)
         except Exception as e:
-            self.logger.exception(f"Error loading input settings: {e}")
+            self.logger.exception("Error loading input settings: %s", e)
 
     def _build_ui(self):
         main_frame = ttk.Frame(self, padding="1")
@@ -184,31 +439,15 @@ class MeasurementApp(tk.Tk):
         inputs_container = ttk.Frame(top_frame)
         inputs_container.pack(side=tk.LEFT, anchor=tk.N)
 
-        # Node Number - more compact
-        node_frame = ttk.Frame(inputs_container)
-        node_frame.pack(side=tk.LEFT, padx=(0, 10), expand=False, fill=tk.BOTH)
-        ttk.Label(node_frame, text="Node #", font=("Arial", 14)).pack(pady=(0,0))
-        
-        node_input_frame = ttk.Frame(node_frame)
-        node_input_frame.pack(pady=(0,0), padx=(5,10), fill=tk.X)
-        ttk.Button(node_input_frame, text="-", width=2, command=self._decrement_node, padding=[5, 1]).pack(side=tk.LEFT, padx=(0,1), pady=0)
+        # Node and Plant Number - more compact
         self.node_var = tk.StringVar(value="1")
-        node_entry = ttk.Entry(node_input_frame, textvariable=self.node_var, width=4, justify='center', font=("Arial", 14))
-        node_entry.pack(side=tk.LEFT, padx=(0,1), pady=0, expand=True, fill=tk.X)
-        ttk.Button(node_input_frame, text="+", width=2, command=self._increment_node, padding=[5, 1]).pack(side=tk.LEFT, pady=0)
-
-        # Plant Number - more compact
-        plant_frame = ttk.Frame(inputs_container)
-        plant_frame.pack(side=tk.LEFT, padx=(5, 10), expand=False, fill=tk.BOTH)
-        ttk.Label(plant_frame, text="Plant #", font=("Arial", 14)).pack(pady=(0,0))
-        
-        plant_input_frame = ttk.Frame(plant_frame)
-        plant_input_frame.pack(pady=(0,0), fill=tk.X)
-        ttk.Button(plant_input_frame, text="-", width=2, command=self._decrement_plant, padding=[5, 1]).pack(side=tk.LEFT, padx=(0,1), pady=0)
+        self._build_counter(inputs_container, "Node #", self.node_var,
+                            self._decrement_node, self._increment_node,
+                            frame_padx=(0, 10), input_padx=(5, 10))
         self.plant_var = tk.StringVar(value="1")
-        plant_entry = ttk.Entry(plant_input_frame, textvariable=self.plant_var, width=4, justify='center', font=("Arial", 14))
-        plant_entry.pack(side=tk.LEFT, padx=(0,1), pady=0, expand=True, fill=tk.X)
-        ttk.Button(plant_input_frame, text="+", width=2, command=self._increment_plant, padding=[5, 1]).pack(side=tk.LEFT, pady=0)
+        self._build_counter(inputs_container, "Plant #", self.plant_var,
+                            self._decrement_plant, self._increment_plant,
+                            frame_padx=(5, 10))
 
         # --- Actions on the right ---
         actions_container = ttk.Frame(top_frame)
@@ -217,20 +456,20 @@ class MeasurementApp(tk.Tk):
         buttons_frame = ttk.Frame(actions_container)
         buttons_frame.pack(fill=tk.X) 
         
-        self.start_single_btn = ttk.Button(buttons_frame, text="Single", command=self._start_single, padding=[12, 8])
+        self.start_single_btn = _make_button(buttons_frame, "Single", self._start_single, _ACTION_BTN_KW)
         self.start_single_btn.pack(side=tk.LEFT, padx=5, pady=5, fill=tk.X) 
         
-        self.start_reps_btn = ttk.Button(buttons_frame, text="3 Reps", command=self._start_multiple_reps, padding=[12, 8])
+        self.start_reps_btn = _make_button(buttons_frame, "3 Reps", self._start_multiple_reps, _ACTION_BTN_KW)
         self.start_reps_btn.pack(side=tk.LEFT, padx=5, pady=5, fill=tk.X)
 
         self.status_var = tk.StringVar(value="Last measurement: None")
-        ttk.Label(buttons_frame, textvariable=self.status_var, font=("Arial", 12)).pack(side=tk.LEFT, padx=(10, 0), pady=0)
+        ttk.Label(buttons_frame, textvariable=self.status_var, font=STATUS_FONT).pack(side=tk.LEFT, padx=(10, 0), pady=0)
 
         # --- Error Status Display ---
         error_frame = ttk.Frame(main_frame)
         error_frame.pack(fill=tk.X, pady=(1, 1))
         
-        ttk.Label(error_frame, text="System Status:", font=("Arial", 12)).pack(side=tk.LEFT, padx=(5, 5))
+        ttk.Label(error_frame, text="System Status:", font=STATUS_FONT).pack(side=tk.LEFT, padx=(5, 5))
         self.error_status_var = tk.StringVar(value="Ready")
         self.error_status_label = ttk.Label(error_frame, textvariable=self.error_status_var, style="Success.TLabel")
         self.error_status_label.pack(side=tk.LEFT, padx=(0, 10))
@@ -243,6 +482,7 @@ class MeasurementApp(tk.Tk):
         # --- Plots - remove figsize to let it auto-size ---
         self.fig = Figure()
         self.ax_force, self.ax_s21 = self.fig.subplots(1, 2)
+        self._flag_kw = dict(_FLAG_TEXT_KW, transform=self.ax_force.transAxes, fontsize=12)
         self.canvas = FigureCanvasTkAgg(self.fig, master=main_frame)
         self.canvas.get_tk_widget().pack(fill=tk.X, pady=(1, 1))
         self.canvas.get_tk_widget().config(height=350)  # Reduced height to make room for error status
@@ -255,22 +495,36 @@ class MeasurementApp(tk.Tk):
         # Left side buttons
         left_buttons = ttk.Frame(bottom_frame)
         left_buttons.pack(side=tk.LEFT)
-        ttk.Button(left_buttons, text="Remove", command=self._remove_previous_measurement, padding=[8, 3]).pack(side=tk.LEFT, padx=2)
-        self.calibrate_btn = ttk.Button(left_buttons, text="Calibrate", command=self._calibrate, padding=[8, 3])
+        _make_button(left_buttons, "Remove", self._remove_previous_measurement).pack(side=tk.LEFT, padx=2)
+        self.calibrate_btn = _make_button(left_buttons, "Calibrate", self._calibrate)
         self.calibrate_btn.pack(side=tk.LEFT, padx=2)
-        self.stop_btn = ttk.Button(left_buttons, text="Stop", state="disabled", command=self._stop, padding=[8, 3])
+        self.stop_btn = _make_button(left_buttons, "Stop", self._stop, state="disabled")
         self.stop_btn.pack(side=tk.LEFT, padx=2)
-        ttk.Button(left_buttons, text="Reset Serial", command=self._reset_serial, padding=[8, 3]).pack(side=tk.LEFT, padx=2)
+        _make_button(left_buttons, "Reset Serial", self._reset_serial).pack(side=tk.LEFT, padx=2)
         
         # Right side buttons
         right_buttons = ttk.Frame(bottom_frame)
         right_buttons.pack(side=tk.RIGHT)
-        ttk.Button(right_buttons, text="Exit", command=self._exit_app, padding=[8, 3]).pack(side=tk.RIGHT, padx=2)
-        ttk.Button(right_buttons, text="Restart", command=self._restart_app, padding=[8, 3]).pack(side=tk.RIGHT, padx=2)
+        _make_button(right_buttons, "Exit", self._exit_app).pack(side=tk.RIGHT, padx=2)
+        _make_button(right_buttons, "Restart", self._soft_restart).pack(side=tk.RIGHT, padx=2)
         
         # Initially disable measurement buttons until calibration is done
         self._set_measurement_buttons_state("disabled")
 
+    def _build_counter(self, parent, label, var, decrement, increment,
+                       frame_padx, input_padx=0):
+        """Build a labelled '- [entry] +' number input bound to var."""
+        frame = ttk.Frame(parent)
+        frame.pack(side=tk.LEFT, padx=frame_padx, expand=False, fill=tk.BOTH)
+        ttk.Label(frame, text=label, font=INPUT_FONT).pack(pady=(0,0))
+        
+        input_frame = ttk.Frame(frame)
+        input_frame.pack(pady=(0,0), padx=input_padx, fill=tk.X)
+        _make_button(input_frame, "-", decrement, _STEP_BTN_KW).pack(side=tk.LEFT, padx=(0,1), pady=0)
+        entry = ttk.Entry(input_frame, textvariable=var, width=4, justify='center', font=INPUT_FONT)
+        entry.pack(side=tk.LEFT, padx=(0,1), pady=0, expand=True, fill=tk.X)
+        _make_button(input_frame, "+", increment, _STEP_BTN_KW).pack(side=tk.LEFT, pady=0)
+
     def _increment_var(self, var, max_val=None):
         try:
             val = int(var.get())
@@ -294,23 +548,18 @@ class MeasurementApp(tk.Tk):
 
     def _update_last_measurement_label(self):
         try:
-            metadata = {}
-            if os.path.exists(self.metadata_file):
-                with open(self.metadata_file, 'r') as f:
-                    metadata = json.load(f)
-            log = metadata.get('measurement_log', [])
-            if not log:
+            pending = self._pending_log
+            entry = pending[-1] if pending else self._read_last_log_entry()
+            if entry is None:
                 self.status_var.set("Last measurement: None")
                 return
 
-            last_entry = log[-1]['us_properties']
+            last_entry = entry['us_properties']
             ts_iso = last_entry['timestamp']
-            timestamp = dt.fromisoformat(ts_iso).strftime("%Y%m%d_%H%M%S")
-            s2p = os.path.join(OUTPUT_DIR, f"sweep_{timestamp}.s2p")
-            csv = os.path.join(OUTPUT_DIR, f"fd_{timestamp}.csv")
-            s2p_size = f"{os.path.getsize(s2p)/1024:.1f}KB" if os.path.exists(s2p) else "N/A"
-            csv_size = f"{os.path.getsize(csv)/1024:.1f}KB" if os.path.exists(csv) else "N/A"
-            self.status_var.set(f"Last: {timestamp}, s2p: {s2p_size}, csv: {csv_size}")
+            timestamp = _iso_to_tag(ts_iso)
+            s2p = f"{_OUTPUT_PREFIX}sweep_{timestamp}.s2p"
+            csv = f"{_OUTPUT_PREFIX}fd_{timestamp}.csv"
+            self.status_var.set(f"Last: {timestamp}, s2p: {_file_kb(s2p)}, csv: {_file_kb(csv)}")
         except Exception:
             self.status_var.set("Last measurement: Error reading logs")
             self.logger.exception("Error updating last measurement label")
@@ -319,44 +568,99 @@ class MeasurementApp(tk.Tk):
         if not messagebox.askyesno("Confirm", "Remove last measurement and its files?"):
             return
         try:
-            metadata = {}
-            if not os.path.exists(self.metadata_file):
-                messagebox.showinfo("Info", "No metadata file. Nothing to remove.")
+            with self._metadata_lock:
+                pending = self._pending_log.pop() if self._pending_log else None
+            if pending is not None:
+                # Not written to the log yet; dropping it from the queue is enough
+                last_entry = pending['us_properties']
+                timestamp = _iso_to_tag(last_entry['timestamp'])
+                _remove_if_exists(f"{_OUTPUT_PREFIX}sweep_{timestamp}.s2p")
+                _remove_if_exists(f"{_OUTPUT_PREFIX}fd_{timestamp}.csv")
+                messagebox.showinfo("Success", f"Removed measurement: {timestamp}")
+                self._update_last_measurement_label()
+                self._create_dummy_plot()
                 return
-            with open(self.metadata_file, 'r') as f:
-                metadata = json.load(f)
-            log = metadata.get('measurement_log', [])
-            if not log:
-                messagebox.showinfo("Info", "Log is empty. Nothing to remove.")
+            try:
+                f = open(self.log_file, 'r+b')
+            except FileNotFoundError:
+                messagebox.showinfo("Info", "No measurement log. Nothing to remove.")
                 return
+            with f:
+                offset, line = _find_last_line(f)
+                if line is None:
+                    messagebox.showinfo("Info", "Log is empty. Nothing to remove.")
+                    return
 
-            last_entry = log.pop()['us_properties']
-            ts_iso = last_entry['timestamp']
-            timestamp = dt.fromisoformat(ts_iso).strftime("%Y%m%d_%H%M%S")
-            
-            s2p = os.path.join(OUTPUT_DIR, f"sweep_{timestamp}.s2p")
-            csv = os.path.join(OUTPUT_DIR, f"fd_{timestamp}.csv")
-            if os.path.exists(s2p): os.remove(s2p)
-            if os.path.exists(csv): os.remove(csv)
+                last_entry = json.loads(line)['us_properties']
+                ts_iso = last_entry['timestamp']
+                timestamp = _iso_to_tag(ts_iso)
+                
+                s2p = f"{_OUTPUT_PREFIX}sweep_{timestamp}.s2p"
+                csv = f"{_OUTPUT_PREFIX}fd_{timestamp}.csv"
+                _remove_if_exists(s2p)
+                _remove_if_exists(csv)
 
-            metadata['measurement_log'] = log
-            with open(self.metadata_file, 'w') as f:
-                json.dump(metadata, f, indent=4)
+                # Drop the entry by cutting the file off where its line starts
+                f.truncate(offset)
                 
             messagebox.showinfo("Success", f"Removed measurement: {timestamp}")
             self._update_last_measurement_label()
-            self.fig.clear()
-            self.canvas.draw()
+            self._create_dummy_plot()
         except Exception as e:
             messagebox.showerror("Error", f"Failed to remove last measurement: {e}")
             self.logger.exception("Error removing last measurement")
 
+    def _soft_restart(self):
+        """Return the GUI to its start-up state without reloading the interpreter."""
+        busy = [t for t in (self.measure_thread, self._serial_reset_thread) if t]
+        if any(t.is_alive() for t in busy):
+            # A worker still owns the serial port; only a new process is safe
+            self._restart_app()
+            return
+        self._reset_state()
+        self._update_last_measurement_label()
+        self.logger.info("Application state reset")
+        self.after_idle(self._show_calibration_notice)
+
+    def _reset_state(self):
+        """Drop calibration, errors and plots back to what __init__ sets up."""
+        if self.protocol:
+            try:
+                self.protocol.close()
+            except Exception:
+                self.logger.exception("Error closing protocol during restart")
+            self.protocol = None
+        self._close_vna()
+        self.measure_thread = None
+        self.stop_event.clear()
+
+        self.is_calibrated = False
+        self.zero_offset_mm = 0.0
+        self.diameter_extractor = DiameterExtractor()  # drops its calibration too
+        self.current_errors.clear()
+        self.last_arduino_state = None
+
+        self._invalidate_metadata()
+        self._load_input_settings()
+        self.node_var.set("1")
+        self.plant_var.set("1")
+
+        self.calibrate_btn.config(text="Calibrate", state="normal")
+        self._set_measurement_buttons_state("disabled")
+        self._update_error_status("Ready")
+        self._create_dummy_plot()
+
     def _restart_app(self):
+        """Replace this process with a fresh interpreter (reloads every module)."""
         self.destroy()
+        # execl skips atexit, so push out anything still buffered
+        self._log_buffer.flush()
         os.execl(sys.executable, sys.executable, *sys.argv)
 
     def _calibrate(self):
         """Perform calibration using a 12.05mm PMMA cylinder to determine zero offset."""
+        if self._serial_reset_thread and self._serial_reset_thread.is_alive():
+            return  # the button comes back once the reset has finished
         if not messagebox.askyesno("Calibration", 
                                    "Is the 12.05mm PMMA cylinder properly positioned in the sensor?"):
             return
@@ -376,18 +680,13 @@ class MeasurementApp(tk.Tk):
         
         try:
             timestamp = dt.now().strftime("%Y%m%d_%H%M%S")
-            fd_csv = os.path.join(OUTPUT_DIR, f"cal_{timestamp}.csv")
-            s2p_file = os.path.join(OUTPUT_DIR, f"sweep_cal_{timestamp}.s2p")
+            fd_csv = f"{_OUTPUT_PREFIX}cal_{timestamp}.csv"
+            s2p_file = f"{_OUTPUT_PREFIX}sweep_cal_{timestamp}.s2p"
             
             self.logger.info("Starting calibration measurement...")
             
             # Initialize VNA
-            self.logger.info("Configuring NanoVNA...")
-            self.vna_ctrl = NanoVnaController(
-                calibration_filename=os.path.join(os.path.dirname(SCRIPT_DIR), "calibration", "calibration_10-500khz.cal"),
-                sweep_range=(10e3, 500e3, 256),
-                hub_location="1-1.2", hub_port=1, output_dir=OUTPUT_DIR
-            )
+            self._ensure_vna()
 
             vna_success = False
             def run_vna():
@@ -414,7 +713,7 @@ class MeasurementApp(tk.Tk):
             if self.stop_event.is_set():
                 self.logger.warning("Calibration stopped by user.")
                 self._cleanup_failed_measurement(fd_csv)
-                if os.path.exists(s2p_file): os.remove(s2p_file)
+                _remove_if_exists(s2p_file)
                 self.after(0, self._calibration_failed, "Calibration cancelled by user")
                 return
 
@@ -435,29 +734,25 @@ class MeasurementApp(tk.Tk):
             self.after(0, lambda: self._handle_measurement_errors(self.protocol))
             
             if vna_success:
-                # Calculate diameter using current extractor (before calibration)
-                calculated_diameter, flags, flaginfo_list = \
-                    self.diameter_extractor.diameter_from_force_data(force_data_df)
-                
+                # One analysis gives the uncalibrated diameter and the flush
+                # index; the calibrated diameter is derived from that index.
+                # Same in-memory readings as a measurement, so the offset is
+                # derived the way it is applied
+                actual_diameter_mm = 12.05
+                force_N, deflection_mm = self.protocol.get_sweep_arrays()
+                calculated_diameter, flags, flaginfo_list, calculated_diameter_calibrated = \
+                    self.diameter_extractor.calibrate(force_N, deflection_mm, actual_diameter_mm)
+                self.zero_offset_mm = self.diameter_extractor.zero_offset_mm
+
                 flaginfo = {} # Initialize as empty dict
                 if flaginfo_list:
                     flaginfo = flaginfo_list[0] # Extract the dictionary from the list
-
-                # Get the flush index for calibration
-                _, flush_idx, _ = self.diameter_extractor.get_step_flush_indices(force_data_df)
-
-                # Set calibration using known diameter and measured flush index
-                actual_diameter_mm = 12.05
-                self.diameter_extractor.set_calibration(actual_diameter_mm, flush_idx)
-                self.zero_offset_mm = self.diameter_extractor.zero_offset_mm
-                
-                # Recalculate diameter with new calibration
-                calculated_diameter_calibrated, _, _ = \
-                    self.diameter_extractor.diameter_from_force_data(force_data_df)
                 
-                self.logger.info(f"Calibration complete. Initial diameter: {calculated_diameter:.3f}mm, "
-                               f"Calibrated diameter: {calculated_diameter_calibrated:.3f}mm, "
-                               f"Actual: {actual_diameter_mm}mm, Zero offset: {self.zero_offset_mm:.3f}mm")
+                self.logger.info("Calibration complete. Initial diameter: %.3fmm, "
+                                 "Calibrated diameter: %.3fmm, "
+                                 "Actual: %smm, Zero offset: %.3fmm",
+                                 calculated_diameter, calculated_diameter_calibrated,
+                                 actual_diameter_mm, self.zero_offset_mm)
                 
                 # Save calibration as a measurement entry
                 self._update_metadata(f"cal_{timestamp}", "0", None, 1, 
@@ -483,6 +778,7 @@ class MeasurementApp(tk.Tk):
 
         except ConnectionError as ce:
             self.logger.exception("Connection error during calibration.")
+            self._close_vna()
             # Try to reset serial connections automatically
             try:
                 self._cleanup_serial_connections()
@@ -491,6 +787,7 @@ class MeasurementApp(tk.Tk):
             self.after(0, self._calibration_failed, "Connection error. Please check Arduino connection and try again.")
         except Exception as e:
             self.logger.exception("An error occurred during calibration.")
+            self._close_vna()
             # Try to reset serial connections on any error
             try:
                 self._cleanup_serial_connections()
@@ -501,6 +798,29 @@ class MeasurementApp(tk.Tk):
         finally:
             if self.protocol:
                 self.protocol.close()
+
+    def _ensure_vna(self):
+        """Make self.vna_ctrl a connected NanoVnaController.
+
+        The controller (connection and loaded calibration file) is kept for
+        the lifetime of the app and only rebuilt once it has been closed
+        after an error or the VNA has dropped off the bus.
+        """
+        if self.vna_ctrl is not None:
+            if self.vna_ctrl.is_connected():
+                return
+            self._close_vna()
+        self.logger.info("Configuring NanoVNA...")
+        self.vna_ctrl = NanoVnaController(
+            calibration_filename=CAL_PATH,
+            sweep_range=(10e3, 500e3, 256),
+            hub_location="1-1.2", hub_port=1, output_dir=OUTPUT_DIR
+        )
+
+    def _close_vna(self):
+        if self.vna_ctrl is not None:
+            self.vna_ctrl.close()
+            self.vna_ctrl = None
     
     def _show_calibration_results(self, calculated_diameter, actual_diameter, s2p_file):
         """Update the plot to show calibration results including power spectrum."""
@@ -509,38 +829,33 @@ class MeasurementApp(tk.Tk):
         self.ax_force.set_title(title_text, fontsize=10)
         
         # Add power spectrum plot if S2P file exists
-        # Clear the s21 axis before plotting new data
-        self.ax_s21.clear()
-        if os.path.exists(s2p_file):
-            freq, s21_db = [], []
-            try:
-                with open(s2p_file, 'r') as f:
-                    for line in f:
-                        if line.strip() and not line.startswith(('!', '#')):
-                            parts = line.split()
-                            if len(parts) >= 5:
-                                f_val = float(parts[0])
-                                s21_real = float(parts[3])
-                                s21_imag = float(parts[4])
-                                s21 = max(
-                                    (s21_real**2 + s21_imag**2)**0.5, 1e-12
-                                )
-                                freq.append(f_val / 1000)  # to kHz
-                                s21_db.append(20 * math.log10(s21))
-                if freq and s21_db:
-                    self.ax_s21.plot(freq, s21_db, marker='.', linestyle='-', color='red')
-                    self.ax_s21.set_xlabel("Frequency (kHz)", fontsize=9)
-                    self.ax_s21.set_ylabel("S21 (dB)", fontsize=9)
-                    self.ax_s21.set_title("Calibration Power Spectrum (S21)", fontsize=10)
-                    self.ax_s21.grid(True)
-                    self.ax_s21.tick_params(labelsize=8)
-            except (ValueError, IndexError):
-                pass  # Ignore malformed lines
-        else:
+        freq = s21_db = None
+        s2p_found = True
+        try:
+            freq, s21_db = read_s21_db(s2p_file)
+            if not len(freq):
+                freq = None
+        except FileNotFoundError:
+            s2p_found = False
+        except ValueError:
+            pass  # Unreadable file
+
+        if freq is not None:
+            # plot_force_deflection has normally just drawn this spectrum;
+            # update its line in place instead of clearing and rebuilding the axes
+            replot(self.ax_s21, freq, s21_db, marker='.', linestyle='-', color='red')
+            self.ax_s21.set_xlabel("Frequency (kHz)", fontsize=9)
+            self.ax_s21.set_ylabel("S21 (dB)", fontsize=9)
+            self.ax_s21.set_title("Calibration Power Spectrum (S21)", fontsize=10)
+            self.ax_s21.tick_params(labelsize=8)
+        elif not s2p_found:
+            self.ax_s21.clear()
             self.ax_s21.text(0.5, 0.5, "s2p file not found\nor has no data", ha="center",
                              va="center", transform=self.ax_s21.transAxes, fontsize=10)
+        else:
+            self.ax_s21.clear()
 
-        self.fig.tight_layout(pad=0.5)
+        # Layout is settled by _update_plot; no second tight_layout pass here
         self.after(0, self._update_plot)
     
     def _calibration_complete(self):
@@ -548,9 +863,11 @@ class MeasurementApp(tk.Tk):
         self.calibrate_btn.config(state="normal")
         self.calibrate_btn.config(text="Re-calibrate")
         self._set_measurement_buttons_state("normal")
-        messagebox.showinfo("Calibration Complete", 
-                          f"Calibration successful!\nZero offset: {self.zero_offset_mm:.3f}mm\n"
-                          f"Measurement buttons are now enabled.")
+        # Let the button states and the calibration plot repaint first
+        self.after_idle(lambda: messagebox.showinfo(
+            "Calibration Complete",
+            f"Calibration successful!\nZero offset: {self.zero_offset_mm:.3f}mm\n"
+            f"Measurement buttons are now enabled."))
     
     def _calibration_failed(self, error_msg):
         """Handle calibration failure."""
@@ -577,6 +894,8 @@ class MeasurementApp(tk.Tk):
         self._run_sequence_wrapper(num_repetitions=3)
         
     def _run_sequence_wrapper(self, num_repetitions):
+        if self._serial_reset_thread and self._serial_reset_thread.is_alive():
+            return  # the buttons come back once the reset has finished
         if not self._validate_inputs():
             return
         if not self.is_calibrated:
@@ -598,19 +917,45 @@ class MeasurementApp(tk.Tk):
             messagebox.showwarning("Reset Serial", "Cannot reset serial while measurement is running. Stop measurement first.")
             return
             
+        if self._serial_reset_thread and self._serial_reset_thread.is_alive():
+            return  # a reset is already in progress
+
         self.logger.info("Manual serial reset requested")
+        # Store calibration state before reset
+        was_calibrated = self.is_calibrated
+        protocol, self.protocol = self.protocol, None
+        self._update_error_status("Resetting serial connections...", "warning")
+        # Nothing may open the ports again until the worker is done with them
+        self._set_measurement_buttons_state("disabled")
+        self.calibrate_btn.config(state="disabled")
+
+        # Closing the protocol and cycling the ports blocks for a second or
+        # more, so it runs on a worker thread and reports back via after()
+        def worker():
+            error = None
+            try:
+                # Stop any active protocol
+                if protocol:
+                    protocol.close()
+                self._cleanup_serial_connections()
+            except Exception as e:
+                self.logger.exception("Error during serial reset")
+                error = e
+            self.after(0, self._finish_serial_reset, was_calibrated, error)
+
+        self._serial_reset_thread = threading.Thread(target=worker, daemon=True)
+        self._serial_reset_thread.start()
+
+    def _finish_serial_reset(self, was_calibrated, error):
+        """Report the outcome of a manual serial reset on the UI thread."""
+        self.calibrate_btn.config(state="normal")
+        if error is not None:
+            self._set_measurement_buttons_state("normal" if self.is_calibrated else "disabled")
+            self._update_error_status("Error during serial reset", "error")
+            messagebox.showerror("Reset Serial", f"Error resetting serial connections: {error}")
+            return
+
         try:
-            # Store calibration state before reset
-            was_calibrated = self.is_calibrated
-            
-            # Stop any active protocol
-            if self.protocol:
-                self.protocol.close()
-                self.protocol = None
-            
-            # Clean up serial connections
-            self._cleanup_serial_connections()
-            
             # Clear error status
             self._update_error_status("Serial connections reset - ready for new connection")
             self.current_errors.clear()
@@ -621,7 +966,7 @@ class MeasurementApp(tk.Tk):
                                   f"Serial connections have been reset.\n"
                                   f"Calibration preserved (zero offset: {self.zero_offset_mm:.3f}mm).\n"
                                   f"Measurements can continue without recalibration.")
-                self.logger.info(f"Serial reset completed. Calibration preserved: zero_offset_mm={self.zero_offset_mm:.3f}")
+                self.logger.info("Serial reset completed. Calibration preserved: zero_offset_mm=%.3f", self.zero_offset_mm)
             else:
                 messagebox.showinfo("Reset Serial", "Serial connections have been reset. Please calibrate before taking measurements.")
             
@@ -638,6 +983,7 @@ class MeasurementApp(tk.Tk):
             
         except Exception as e:
             self.logger.exception("Error during serial reset")
+            self._set_measurement_buttons_state("normal" if self.is_calibrated else "disabled")
             self._update_error_status("Error during serial reset", "error")
             messagebox.showerror("Reset Serial", f"Error resetting serial connections: {e}")
 
@@ -646,13 +992,16 @@ class MeasurementApp(tk.Tk):
         try:
             # Store calibration state before reset
             was_calibrated = self.is_calibrated
+
+            # Small delay to let Arduino settle after protocol cleanup
+            time.sleep(0.5)
             
             # Clean up serial connections
             self._cleanup_serial_connections()
             
             # Log the activity
             if was_calibrated:
-                self.logger.info(f"Post-measurement serial reset completed. Calibration preserved: zero_offset_mm={self.zero_offset_mm:.3f}")
+                self.logger.info("Post-measurement serial reset completed. Calibration preserved: zero_offset_mm=%.3f", self.zero_offset_mm)
             else:
                 self.logger.info("Post-measurement serial reset completed.")
             
@@ -673,7 +1022,7 @@ class MeasurementApp(tk.Tk):
 
     def _auto_recovery_attempt(self, error_type):
         """Attempt automatic recovery based on error type"""
-        self.logger.info(f"Attempting automatic recovery for error: {error_type}")
+        self.logger.info("Attempting automatic recovery for error: %s", error_type)
         
         if error_type == ArduinoErrorType.FORCE_SENSOR_ERROR:
             # Try serial reset for sensor issues
@@ -687,30 +1036,99 @@ class MeasurementApp(tk.Tk):
         return False
 
     def _cleanup_failed_measurement(self, csv_file):
-        if os.path.exists(csv_file):
-            try:
-                os.remove(csv_file)
-                self.logger.info(f"Deleted failed measurement CSV: {csv_file}")
-            except Exception:
-                self.logger.exception(f"Error deleting CSV file {csv_file}")
+        try:
+            if _remove_if_exists(csv_file):
+                self.logger.info("Deleted failed measurement CSV: %s", csv_file)
+        except Exception:
+            self.logger.exception("Error deleting CSV file %s", csv_file)
     
+    def _abort_measurement(self, fd_csv, s2p_file, title, message):
+        """Clean up after a measurement that raised and report it to the user."""
+        # Reconnect the VNA from scratch next time
+        self._close_vna()
+        # Try to reset serial connections automatically
+        try:
+            self._cleanup_serial_connections()
+        except Exception:
+            pass
+        # Drop whatever files the measurement got to write
+        self._cleanup_failed_measurement(fd_csv)
+        try:
+            _remove_if_exists(s2p_file)
+        except OSError:
+            self.logger.exception("Error deleting s2p file %s", s2p_file)
+        self.after(0, messagebox.showerror, title, message)
+
+    def _get_rep_index(self):
+        """Return {object_id: highest repetition} for the measurement log.
+
+        Rebuilt from the log only when its mtime or size changed.
+        """
+        try:
+            st = os.stat(self.log_file)
+            stamp = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            stamp = None
+        if self._rep_index is None or stamp != self._rep_stamp:
+            rep_index = {}
+            for measurement in self._iter_log_entries():
+                _note_repetition(rep_index, measurement)
+            self._rep_index, self._rep_stamp = rep_index, stamp
+        return self._rep_index
+
+    def _scan_log_tail(self, object_id):
+        """Return the repetition of the newest log entry for object_id.
+
+        Reads the log from the end, so an object measured recently is found
+        without parsing the rest of the file. Returns None if the object is
+        not in the log; the whole log has been read by then, so the complete
+        repetition index is stored as a side effect.
+        """
+        try:
+            f = open(self.log_file, 'rb')
+        except FileNotFoundError:
+            return None
+        rep_index = {}
+        with f:
+            st = os.fstat(f.fileno())
+            for line in _iter_lines_reversed(f):
+                entry = json.loads(line)
+                props = entry.get('us_properties', {})
+                if props.get('object_id') == object_id:
+                    return int(props.get('repetition', 0))
+                _note_repetition(rep_index, entry)
+        self._rep_index, self._rep_stamp = rep_index, (st.st_mtime_ns, st.st_size)
+        return None
+
     def _get_next_repetition(self, object_id):
-        max_rep = 0
+        # Entries queued by the running sequence are not in the log yet
+        max_rep = max((int(e['us_properties']['repetition']) for e in self._pending_log
+                       if e['us_properties']['object_id'] == object_id), default=0)
         try:
-            if os.path.exists(self.metadata_file):
-                with open(self.metadata_file, 'r') as f:
-                    metadata = json.load(f)
-                for measurement in metadata.get('measurement_log', []):
-                    props = measurement.get('us_properties', {})
-                    if props.get('object_id') == object_id:
-                        rep = int(props.get('repetition', 0))
-                        max_rep = max(max_rep, rep)
+            # Until the index exists, the newest entry for the object is
+            # enough; repetitions are appended in increasing order
+            rep = self._scan_log_tail(object_id) if self._rep_index is None else None
+            if rep is None:
+                rep = self._get_rep_index().get(object_id, 0)
+            max_rep = max(max_rep, rep)
         except (IOError, json.JSONDecodeError):
             self.logger.exception("Could not read metadata to get repetition count.")
         return max_rep + 1
 
     def _run_sequence(self, num_repetitions):
+        self._batch_metadata = True
+        try:
+            self._run_repetitions(num_repetitions)
+        finally:
+            self._batch_metadata = False
+            self._flush_metadata()
+            self.after(0, self._toggle_controls, "normal")
+
+    def _run_repetitions(self, num_repetitions):
         self.stop_event.clear()
+        # The serial reset runs once after the sequence, and only if the
+        # last measurement went well (a failed one is left for error recovery)
+        last_ok = False
         
         for i in range(num_repetitions):
             if self.stop_event.is_set():
@@ -718,27 +1136,22 @@ class MeasurementApp(tk.Tk):
                 break
                 
             repetition_num = self._get_next_repetition(self.plant_var.get())
-            self.logger.info(f"Starting measurement {i+1}/{num_repetitions} (Repetition #{repetition_num})")
+            self.logger.info("Starting measurement %s/%s (Repetition #%s)", i+1, num_repetitions, repetition_num)
 
             timestamp = dt.now().strftime("%Y%m%d_%H%M%S")
             node_number = self.node_var.get()
             object_id = self.plant_var.get()
 
-            fd_csv = os.path.join(OUTPUT_DIR, f"fd_{timestamp}.csv")
-            s2p_file = os.path.join(OUTPUT_DIR, f"sweep_{timestamp}.s2p")
+            fd_csv = f"{_OUTPUT_PREFIX}fd_{timestamp}.csv"
+            s2p_file = f"{_OUTPUT_PREFIX}sweep_{timestamp}.s2p"
             
             # Initialize variables for finally block
             vna_success = False
             has_critical_error = False
+            aborted = False
             
             try:
-                # Initialize VNA
-                self.logger.info("Configuring NanoVNA...")
-                self.vna_ctrl = NanoVnaController(
-                    calibration_filename=os.path.join(os.path.dirname(SCRIPT_DIR), "calibration", "calibration_10-500khz.cal"),
-                    sweep_range=(10e3, 500e3, 256),
-                    hub_location="1-1.2", hub_port=1, output_dir=OUTPUT_DIR
-                )
+                self._ensure_vna()
 
                 vna_success = False
                 def run_vna():
@@ -762,7 +1175,7 @@ class MeasurementApp(tk.Tk):
                 if self.stop_event.is_set():
                     self.logger.warning("Stop detected, cleaning up measurement files.")
                     self._cleanup_failed_measurement(fd_csv)
-                    if os.path.exists(s2p_file): os.remove(s2p_file)
+                    _remove_if_exists(s2p_file)
                     continue # This continue applies to the for loop.
 
                 # Plotting function now returns fig, axes, and dataframe - call AFTER data is written
@@ -789,9 +1202,11 @@ class MeasurementApp(tk.Tk):
                 if vna_success and not has_critical_error:
                     self.logger.info("Measurement successful.")
                     
-                    # Extract diameter and flags AFTER force_data_df is available
+                    # Extract diameter and flags from the readings the protocol
+                    # kept in memory; the DataFrame above only feeds the plot
+                    force_N, deflection_mm = self.protocol.get_sweep_arrays()
                     calculated_diameter, flags, flaginfo_list = \
-                        self.diameter_extractor.diameter_from_force_data(force_data_df)
+                        self.diameter_extractor.diameter_from_arrays(force_N, deflection_mm)
 
                     flaginfo = {} # Initialize as empty dict
                     if flaginfo_list:
@@ -811,10 +1226,7 @@ class MeasurementApp(tk.Tk):
                         y_pos = 0.95  # Start Y position for annotations
                         for flag in flags:
                             text = flaginfo.get(flag, flag)  # Use flaginfo if available, else flag
-                            self.ax_force.text(0.02, y_pos,
-                                     text, transform=self.ax_force.transAxes, color='red', fontsize=12,
-                                     verticalalignment='top',
-                                     bbox=dict(facecolor='white', alpha=0.7))
+                            self.ax_force.text(0.02, y_pos, text, **self._flag_kw)
                             y_pos -= 0.05 # Adjust Y position for next flag
 
                     self.after(0, self._update_plot)
@@ -827,55 +1239,44 @@ class MeasurementApp(tk.Tk):
                     self._cleanup_failed_measurement(fd_csv)
                     self.after(0, lambda: messagebox.showerror("Measurement Failed", "No .s2p file created. CSV file deleted."))
 
-            except ConnectionError as ce:
-                self.logger.exception("Connection error during measurement sequence.")
-                # Try to reset serial connections automatically
-                try:
-                    self._cleanup_serial_connections()
-                except Exception:
-                    pass
-                self.after(0, lambda: messagebox.showerror("Connection Error", 
-                                                           "Connection error. Please check Arduino connection and try again."))
-                self._cleanup_failed_measurement(fd_csv) # Clean up CSV if it was created before the connection failed.
             except Exception as e:
-                self.logger.exception("An error occurred during the measurement sequence.")
-                # Try to reset serial connections on any error
-                try:
-                    self._cleanup_serial_connections()
-                except Exception:
-                    pass
-                self.after(0, lambda: messagebox.showerror("Error", f"An unexpected error occurred: {e}"))
-                self._cleanup_failed_measurement(fd_csv) # Clean up CSV on other errors.
+                if isinstance(e, ConnectionError):
+                    self.logger.exception("Connection error during measurement sequence.")
+                    title, message = "Connection Error", "Connection error. Please check Arduino connection and try again."
+                else:
+                    self.logger.exception("An error occurred during the measurement sequence.")
+                    title, message = "Error", f"An unexpected error occurred: {e}"
+                self._abort_measurement(fd_csv, s2p_file, title, message)
+                aborted = True
             
             finally:
                 if self.protocol:
                     self.protocol.close()
-                    # Small delay to let Arduino settle after protocol cleanup
-                    time.sleep(0.5)
-                    
-                    # Only reset serial connections after successful measurement to prevent Arduino blocking
-                    # Skip reset if measurement failed to avoid interfering with error recovery
-                    if (vna_success and not has_critical_error):
-                        self._reset_serial_silent()
-                    
+                    # An aborted measurement has already had its serial reset
+                    last_ok = vna_success and not has_critical_error and not aborted
+
                 self._update_last_measurement_label()
-        
-        self.after(0, self._toggle_controls, "normal")
+
+        if last_ok:
+            self._reset_serial_silent()
 
     def _update_plot(self):
-        """Triggers a redraw of the Matplotlib canvas."""
-        self.fig.tight_layout()
-        self.canvas.draw()
+        """Schedules a redraw of the Matplotlib canvas."""
+        # The layout solver only needs to run for the first real plot; later
+        # plots use the same labels and fonts, so the margins stay valid
+        if self._layout_dirty:
+            self.fig.tight_layout()
+            self._layout_dirty = False
+        # Coalesces with any other pending redraw and runs when Tk is idle
+        self.canvas.draw_idle()
 
     def _create_dummy_plot(self):
-        # Clear existing axes, don't recreate them
+        # Clear the force axes, don't recreate them; a measurement leaves a
+        # date formatter and flag labels there that the dummy must not keep
         self.ax_force.clear()
-        self.ax_s21.clear()
 
         # Dummy Force vs Time plot
-        time_data = [i for i in range(100)]
-        force_data = [i * 0.1 + math.sin(i / 5.0) for i in time_data]
-        self.ax_force.plot(time_data, force_data, color='blue')
+        self.ax_force.plot(_DUMMY_TIME, _DUMMY_FORCE, color='blue')
         self.ax_force.set_title("Dummy Force vs Time (Est. Diameter: 12.34 mm)", fontsize=10)
         self.ax_force.set_xlabel("Time (s)", fontsize=9)
         self.ax_force.set_ylabel("Force (N)", fontsize=9)
@@ -883,37 +1284,28 @@ class MeasurementApp(tk.Tk):
         self.ax_force.tick_params(labelsize=8)
 
         # Add a dummy flag example
-        self.ax_force.text(0.02, 0.88, "MIP:3 (Dummy Flag)", transform=self.ax_force.transAxes, color='red',
-                 fontsize=10, verticalalignment='top', bbox=dict(facecolor='white', alpha=0.7))
+        self.ax_force.text(0.02, 0.88, "MIP:3 (Dummy Flag)", transform=self.ax_force.transAxes,
+                           fontsize=10, **_FLAG_TEXT_KW)
 
-        # Dummy Power Spectrum (S21) plot
-        freq_data = [i * 10 for i in range(1, 101)]  # 100 points from 10 to 1000 kHz
-        s21_data = [-20 * math.exp(-0.01 * (f - 500)**2) + 10 for f in freq_data] # Example S21 data
-        self.ax_s21.plot(freq_data, s21_data, color='red')
+        # Dummy Power Spectrum (S21) plot, reusing the spectrum line if there is one
+        replot(self.ax_s21, _DUMMY_FREQ, _DUMMY_S21, color='red', marker='None', linestyle='-')
         self.ax_s21.set_title("Dummy Power Spectrum (S21)", fontsize=10)
         self.ax_s21.set_xlabel("Frequency (kHz)", fontsize=9)
         self.ax_s21.set_ylabel("S21 (dB)", fontsize=9)
-        self.ax_s21.grid(True)
         self.ax_s21.tick_params(labelsize=8)
 
         # Use tight layout with minimal padding
         self.fig.tight_layout(pad=0.5)
+        self._layout_dirty = True  # the next real plot lays itself out again
         self.canvas.draw()
 
     def _update_metadata(self, timestamp_str, object_id, node_number, repetition, zero_distance_mm, zero_offset_mm, object_name=None, calculated_diameter=None, flags=None, flaginfo=None):
-        """Updates the metadata JSON file with new measurement details."""
-        try:
-            metadata = {}
-            if os.path.exists(self.metadata_file):
-                with open(self.metadata_file, 'r') as f:
-                    metadata = json.load(f)
-
-            if 'measurement_log' not in metadata:
-                metadata['measurement_log'] = []
+        """Queues the measurement for the log along with the input settings.
 
-            # Convert string timestamp to datetime object then to ISO format
-            ts_dt = dt.strptime(timestamp_str.replace("cal_", ""), "%Y%m%d_%H%M%S")
-            ts_iso = ts_dt.isoformat()
+        Written straight away, or when the running sequence ends.
+        """
+        try:
+            ts_iso = _tag_to_iso(timestamp_str.replace("cal_", ""))
 
             us_properties = {
                 "timestamp": ts_iso,
@@ -940,21 +1332,50 @@ class MeasurementApp(tk.Tk):
                 }
             }
 
-            metadata['measurement_log'].append(new_log_entry)
-
-            if 'input_settings' not in metadata:
-                metadata['input_settings'] = {}
-            metadata['input_settings']['zero_distance_mm'] = zero_distance_mm
-            metadata['input_settings']['node_number'] = node_number
-            metadata['input_settings']['plant_number'] = object_id
-
-            with open(self.metadata_file, 'w') as f:
-                json.dump(metadata, f, indent=4)
-            self.logger.info(f"Metadata updated for timestamp: {timestamp_str}")
-
+            with self._metadata_lock:
+                self._pending_log.append(new_log_entry)
+                self._pending_settings = {
+                    'zero_distance_mm': zero_distance_mm,
+                    'node_number': node_number,
+                    'plant_number': object_id,
+                }
+            self.logger.info("Metadata queued for timestamp: %s", timestamp_str)
         except Exception as e:
-            self.logger.exception("Error updating metadata file.")
-            self.after(0, lambda: messagebox.showerror("Error", f"Failed to update metadata: {e}"))
+            self.logger.exception("Error building metadata entry.")
+            message = f"Failed to update metadata: {e}"
+            self.after(0, messagebox.showerror, "Error", message)
+            return
+        if not self._batch_metadata:
+            self._flush_metadata()
+
+    def _flush_metadata(self):
+        """Write queued log entries and the latest input settings to disk."""
+        error = None
+        with self._metadata_lock:
+            entries, self._pending_log = self._pending_log, []
+            settings, self._pending_settings = self._pending_settings, None
+            try:
+                if entries:
+                    self._append_log_entries(entries)
+                if settings is not None:
+                    metadata = self._get_metadata()
+                    if metadata is None:
+                        metadata = {}
+                    input_settings = metadata.setdefault('input_settings', {})
+                    # Repetitions reuse the same inputs; only rewrite the file on change
+                    if not settings.items() <= input_settings.items():
+                        input_settings.update(settings)
+                        self._save_metadata(metadata)
+                if entries:
+                    self.logger.info("Wrote %d measurement log entries", len(entries))
+            except Exception as e:
+                self._invalidate_metadata()  # the cache may hold unsaved settings
+                self.logger.exception("Error updating metadata file.")
+                error = e
+        # Outside the lock: from a worker thread, after() waits on the main loop
+        if error is not None:
+            message = f"Failed to update metadata: {error}"
+            self.after(0, messagebox.showerror, "Error", message)
 
     def _set_measurement_buttons_state(self, state):
         for btn in [self.start_single_btn, self.start_reps_btn]:
@@ -964,6 +1385,41 @@ class MeasurementApp(tk.Tk):
     def _exit_app(self):
         self.destroy()
 
+    def _join_measurement(self, timeout):
+        """Wait up to timeout seconds for measure_thread; True once it is gone.
+
+        The worker hands UI updates to the main loop with after(), which blocks
+        while this thread sits in join(), so Tk events keep being processed.
+        """
+        worker = self.measure_thread
+        deadline = time.monotonic() + timeout
+        while worker and worker.is_alive() and time.monotonic() < deadline:
+            self.update()
+            worker.join(0.05)
+        return not (worker and worker.is_alive())
+
+    def destroy(self):
+        if self._closing:
+            return  # update() in _join_measurement can deliver a second close
+        self._closing = True
+        # measure_thread is a daemon, so it has to finish (and flush its own
+        # batch) before we return; the final flush then writes whatever is
+        # queued, including the batch of a worker that outlived the timeout
+        self.stop_event.set()
+        finished = self._join_measurement(_WORKER_JOIN_TIMEOUT)
+        self._flush_metadata()
+        if finished:
+            self._close_vna()
+        else:
+            # Closing the VNA under a live sweep would break it mid-transfer;
+            # process exit releases the port instead
+            self.logger.warning("Measurement thread still running at exit; VNA left open")
+        with self._metadata_lock:
+            if self._log_fp:
+                self._log_fp.close()
+                self._log_fp = None
+        super().destroy()
+
     def _update_error_status(self, status_text, status_type="success", has_details=False):
         """Update the error status display"""
         self.error_status_var.set(status_text)
@@ -992,29 +1448,30 @@ class MeasurementApp(tk.Tk):
         self.current_errors = error_summary['recent_errors']
         
         # Update Arduino state
-        if hasattr(protocol, 'ard') and protocol.ard:
-            self.last_arduino_state = protocol.ard.get_state()
+        ard = getattr(protocol, 'ard', None)
+        if ard:
+            self.last_arduino_state = ard.get_state()
         
         # Determine status message and type
         total_errors = error_summary['total_errors']
         error_types = error_summary['error_types']
         is_critical = error_summary['critical_error']
+        error_details = ", ".join(error_types)
         
         if is_critical:
-            status_msg = f"CRITICAL: {', '.join(error_types)} ({total_errors} errors)"
+            status_msg = f"CRITICAL: {error_details} ({total_errors} errors)"
             status_type = "error"
         elif total_errors > 5:
-            status_msg = f"WARNING: {total_errors} errors - {', '.join(error_types)}"
+            status_msg = f"WARNING: {total_errors} errors - {error_details}"
             status_type = "warning"
         else:
-            status_msg = f"Minor issues: {', '.join(error_types)} ({total_errors} errors)"
+            status_msg = f"Minor issues: {error_details} ({total_errors} errors)"
             status_type = "warning"
         
         self._update_error_status(status_msg, status_type, has_details=True)
         
         # Show popup for critical errors
         if is_critical:
-            error_details = ", ".join(error_types)
             messagebox.showerror(
                 "Critical Arduino Error", 
                 f"Measurement failed due to critical error(s):\n{error_details}\n\n"
@@ -1045,28 +1502,30 @@ class MeasurementApp(tk.Tk):
         text_widget.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         
-        # Add error information
-        text_widget.insert(tk.END, "Recent Arduino Errors:\n")
-        text_widget.insert(tk.END, "=" * 50 + "\n\n")
-        
+        # Build the report as one string; each Text.insert is a Tk round trip
+        parts = ["Recent Arduino Errors:\n", "=" * 50 + "\n\n"]
         for i, error in enumerate(self.current_errors, 1):
-            text_widget.insert(tk.END, f"Error {i}:\n")
-            text_widget.insert(tk.END, f"  Time: {error.get('timestamp', 'Unknown')}\n")
-            text_widget.insert(tk.END, f"  Type: {error.get('error_type', 'Unknown')}\n")
-            text_widget.insert(tk.END, f"  Message: {error.get('message', 'No message')}\n")
-            text_widget.insert(tk.END, "\n")
+            parts.append(
+                f"Error {i}:\n"
+                f"  Time: {error.get('timestamp', 'Unknown')}\n"
+                f"  Type: {error.get('error_type', 'Unknown')}\n"
+                f"  Message: {error.get('message', 'No message')}\n\n"
+            )
         
         # Add Arduino state if available
-        if self.last_arduino_state:
-            text_widget.insert(tk.END, "\nArduino State:\n")
-            text_widget.insert(tk.END, "=" * 20 + "\n")
-            text_widget.insert(tk.END, f"Connected: {self.last_arduino_state.is_connected}\n")
-            text_widget.insert(tk.END, f"Last Error: {self.last_arduino_state.last_error.value}\n")
-            text_widget.insert(tk.END, f"Error Count: {self.last_arduino_state.error_count}\n")
-            text_widget.insert(tk.END, f"Consecutive Errors: {self.last_arduino_state.consecutive_errors}\n")
-            text_widget.insert(tk.END, f"Last Force: {self.last_arduino_state.last_force:.3f} N\n")
-            text_widget.insert(tk.END, f"Last Position: {self.last_arduino_state.last_position}\n")
+        state = self.last_arduino_state
+        if state:
+            parts.append("\nArduino State:\n" + "=" * 20 + "\n")
+            parts.append(
+                f"Connected: {state.is_connected}\n"
+                f"Last Error: {state.last_error.value}\n"
+                f"Error Count: {state.error_count}\n"
+                f"Consecutive Errors: {state.consecutive_errors}\n"
+                f"Last Force: {state.last_force:.3f} N\n"
+                f"Last Position: {state.last_position}\n"
+            )
         
+        text_widget.insert(tk.END, "".join(parts))
         text_widget.configure(state=tk.DISABLED)
         
         # Close button
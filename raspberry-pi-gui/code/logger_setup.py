@@ -3,29 +3,152 @@
 Logger that redirects output to console and error.log file.
 """
 
+import atexit
+import queue
 import sys
 import threading
+import time
+
+# Maximum number of queued messages written to disk in one go
+WRITE_BATCH = 64
+# Partial lines are held per thread until a newline or this many characters
+LINE_BUFFER_SIZE = 4096
+# Seconds written text may sit in the file buffer before it is flushed
+FLUSH_INTERVAL = 1.0
+
+
+class _LogWriter:
+    """
+    Background thread that owns one log file and writes what is queued.
+
+    Every DualLogger on the same file shares one writer, so lines land in
+    the file in the order they were queued, whichever stream they came
+    through. Besides text, the queue carries markers: None stops the
+    thread, and a threading.Event asks it to empty the file (see clear).
+    """
+    def __init__(self, log_file):
+        # Block buffered; the writer thread flushes it every FLUSH_INTERVAL
+        self.log_file = open(log_file, "a", buffering=65536)
+        self.queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._drain, daemon=True)
+        self._thread.start()
+        atexit.register(self._shutdown)
+
+    def clear(self, timeout):
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait(timeout)
+
+    def _drain(self):
+        q = self.queue
+        dirty = False
+        last_flush = time.monotonic()
+        while True:
+            try:
+                # Only wake up on a timer while there is something to flush
+                batch = [q.get(timeout=FLUSH_INTERVAL if dirty else None)]
+            except queue.Empty:
+                self.log_file.flush()
+                dirty = False
+                last_flush = time.monotonic()
+                continue
+            try:
+                while len(batch) < WRITE_BATCH and isinstance(batch[-1], str):
+                    batch.append(q.get_nowait())
+            except queue.Empty:
+                pass
+            last = batch[-1]
+            if not isinstance(last, str):
+                batch.pop()
+            now = time.monotonic()
+            if isinstance(last, threading.Event):
+                # clear(): the lines before the marker go with the file
+                self.log_file.flush()
+                self.log_file.seek(0)
+                self.log_file.truncate(0)
+                dirty = False
+                last_flush = now
+                last.set()
+                continue
+            done = last is None
+            self.log_file.write("".join(batch))
+            dirty = True
+            if done or now - last_flush >= FLUSH_INTERVAL:
+                self.log_file.flush()
+                dirty = False
+                last_flush = now
+            if done:
+                return
+
+    def _shutdown(self):
+        # Registered before the DualLoggers' handlers, so it runs after them
+        self.queue.put(None)
+        self._thread.join(timeout=2)
+
+
+# One writer per log file path, shared by every DualLogger on that file
+_writers = {}
 
 
 class DualLogger:
     """
     Logger that writes messages to both the original stream and a log file.
+
+    Disk writes are queued and done by a background thread, so callers never
+    wait on the SD card. Each thread's output is queued a whole line at a
+    time (print and logging hand over text and newline separately), which
+    also keeps lines from different threads from interleaving. Loggers on
+    the same file share that thread (see _LogWriter). Anything still queued
+    is written out at exit.
     """
     def __init__(self, stream, log_file="error.log"):
         self.stream = stream
-        # Open the log file in append mode with line buffering
-        self.log_file = open(log_file, "a", buffering=1)
+        writer = _writers.get(log_file)
+        if writer is None:
+            writer = _writers[log_file] = _LogWriter(log_file)
+        self._writer = writer
+        self._queue = writer.queue
+        self._local = threading.local()
+        atexit.register(self.flush)
 
     def write(self, message):
         if threading.current_thread() is threading.main_thread():
             self.stream.write(message)
-        self.log_file.write(message)
+        local = self._local
+        try:
+            pending = local.pending
+        except AttributeError:
+            pending = local.pending = []
+            local.size = 0
+        pending.append(message)
+        local.size += len(message)
+        if message.endswith("\n") or local.size >= LINE_BUFFER_SIZE:
+            self._queue.put("".join(pending))
+            pending.clear()
+            local.size = 0
 
     def flush(self):
+        # logging calls this after every record; the file side is flushed
+        # by the writer thread instead of blocking the caller
         if threading.current_thread() is threading.main_thread():
             self.stream.flush()
-        self.log_file.flush()
+        pending = getattr(self._local, "pending", None)
+        if pending:
+            self._queue.put("".join(pending))
+            pending.clear()
+            self._local.size = 0
+
+    def clear(self, timeout=2.0):
+        """Empty the log file, dropping everything written before this call.
+
+        The writer thread does the truncation in queue order, so lines
+        queued or buffered earlier cannot reappear after it; this covers
+        every logger sharing the file. Waits up to timeout seconds for that
+        to happen.
+        """
+        self.flush()
+        self._writer.clear(timeout)
 
 
 sys.stdout = DualLogger(sys.stdout)
-sys.stderr = DualLogger(sys.stderr) 
\ No newline at end of file
+sys.stderr = DualLogger(sys.stderr)
@@ -4,8 +4,11 @@ Force-Deflection Measurement and Young's Modulus Extraction
 """
 import logger_setup  # noqa: F401
 import csv
+import logging
+import math
 import time
 import threading
+import warnings
 from datetime import datetime
 from arduino_force_controller import ArduinoForceController, ArduinoErrorType
 import matplotlib.pyplot as plt
@@ -17,6 +20,8 @@ import sys
 import pandas as pd
 import matplotlib.dates as mdates
 
+logger = logging.getLogger(__name__)
+
 # Configuration
 PORT = "/dev/ttyACM0"  # Changed from ttyACM1 to ttyACM0 (more common)
 TARGET_FORCE = 9.0  # N
@@ -43,44 +48,112 @@ MICROSTEP_DIVIDER = 1  # MS1=0,MS2=0,MS3=0 => full step (no microstepping)
 STEPS_PER_MM = (STEPS_PER_REV * MICROSTEP_DIVIDER) / LEAD_MM_PER_REV
 # e.g. (200*1)/2 = 100 steps per mm => 0.01 mm per step
 
+# Readings are written to the CSV in batches of this many rows
+CSV_WRITE_BATCH = 50
+
+# 20 * log10(x) == _DB_PER_NEPER * ln(x); the natural log is the cheaper call
+_DB_PER_NEPER = 20.0 / math.log(10.0)
+
+
+def replot(ax, x, y, **style):
+    """Make (x, y) the only line on ax, updating its line in place if it has exactly one."""
+    lines = ax.lines
+    if len(lines) == 1 and not ax.texts:
+        line = lines[0]
+        line.set_data(x, y)
+        line.set(**style)
+        ax.relim()
+        ax.autoscale_view()
+    else:
+        ax.clear()
+        ax.plot(x, y, **style)
+        ax.grid(True)
+
+
+def _s21_to_db(re_part, im_part):
+    """Return 20*log10(|S21|) in dB, clamped at 1e-12, using one float64 buffer."""
+    out = np.hypot(re_part, im_part)
+    np.maximum(out, 1e-12, out=out)
+    np.log(out, out=out)
+    out *= _DB_PER_NEPER
+    return out
+
+
+def read_s21_db(s2p_filename):
+    """Return (frequency in kHz, |S21| in dB) arrays from a Touchstone .s2p file.
+
+    Lines that do not hold a complete data row are skipped, so a damaged
+    file still gives the data it has.
+    """
+    try:
+        # An empty file only warns ("input contained no data") and gives no rows
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", UserWarning)
+            data = np.loadtxt(s2p_filename, comments=('!', '#'), usecols=(0, 3, 4), ndmin=2)
+    except ValueError:
+        # Ragged or partly written file: keep the rows that parse. genfromtxt
+        # warns once per bad line (ConversionWarning is a UserWarning), which
+        # would end up in error.log; one summary line is logged instead
+        with open(s2p_filename) as f, warnings.catch_warnings():
+            warnings.simplefilter("ignore", UserWarning)
+            data = np.genfromtxt(
+                (line for line in f if not line.startswith(('!', '#'))),
+                usecols=(0, 3, 4), invalid_raise=False, ndmin=2,
+            )
+        if data.shape[1] == 3:
+            data = data[~np.isnan(data).any(axis=1)]
+        else:
+            data = np.empty((0, 3))
+        logger.warning("Damaged s2p file %s: skipped bad lines, kept %d rows",
+                       s2p_filename, len(data))
+    return data[:, 0] / 1000, _s21_to_db(data[:, 1], data[:, 2])
+
+
 # ── PROTOCOL ─────────────────────────────────────────────────────────────────
 class MeasurementProtocol:
     def __init__(self, csv_filename=None, on_measurement_start=None, stop_event=None):
+        self.logger = logging.getLogger(self.__class__.__name__)
         target_file = csv_filename if csv_filename else CSV_FILENAME
-        self._csv_file = open(target_file, "w", newline="")
+        self._csv_file = open(target_file, "w", newline="", buffering=1 << 16)
         self._csv_writer = csv.writer(self._csv_file)
         self._csv_writer.writerow(["timestamp", "force_N", "deflection_mm"])
+        # Rows not yet handed to the CSV writer, in a fixed block that is
+        # written out and reused each time it fills up
+        self._row_buf = np.empty((CSV_WRITE_BATCH, 3))
+        self._row_count = 0
         # Callback for starting external measurement (e.g., NanoVNA)
         self._on_measurement_start = on_measurement_start
-        print(
-            f">>> MeasurementProtocol init: callback = "
-            f"{self._on_measurement_start is not None}"
-        )
+        self.logger.debug("MeasurementProtocol init: callback = %s",
+                          self._on_measurement_start is not None)
         # Thread handle for external measurement
         self._vna_thread = None
+        # A plain flag: one assignment is atomic, so it needs no lock
         self._logging_active = False
-        self._lock = threading.Lock()
+        self._lock = threading.Lock()  # guards the row buffer
         
         # Error tracking
         self._arduino_errors = []
         self._critical_error_occurred = False
         self._error_recovery_attempted = False
         
-        print(f">>> Initializing Arduino connection on port: {PORT}")
+        self.logger.info("Initializing Arduino connection on port: %s", PORT)
         try:
             self.ard = ArduinoForceController(
                 port=PORT,
                 on_reading=self._on_reading,
                 on_error=self._on_arduino_error  # New error callback
             )
-            print(">>> Arduino connection established successfully")
+            self.logger.info("Arduino connection established successfully")
         except Exception as e:
-            print(f">>> ERROR: Failed to connect to Arduino: {e}")
+            self.logger.error("Failed to connect to Arduino: %s", e)
             raise
         # used to detect first arrival in the target window
         self._meas_started = threading.Event()
         # event to signal measurement completion
         self._finished = threading.Event()
+        # set when the Arduino reports an error line, which ends the homing wait
+        self._homed = threading.Event()
+        self._homed_signal = ""
         self.stop_event = stop_event # Store the stop event
 
     def _on_arduino_error(self, error_type: ArduinoErrorType, message: str):
@@ -91,36 +164,47 @@ class MeasurementProtocol:
             'message': message
         }
         self._arduino_errors.append(error_info)
+        self._homed_signal = message
+        self._homed.set()
         
-        print(f">>> Arduino Error: {error_type.value} - {message}")
+        self.logger.warning("Arduino error: %s - %s", error_type.value, message)
         
         # Check for critical errors that should stop measurement
         # CONNECTION_LOST during measurement completion is often normal, so be more careful
         if error_type == ArduinoErrorType.FORCE_SENSOR_ERROR:
             self._critical_error_occurred = True
-            print(f">>> CRITICAL ERROR: {error_type.value} - stopping measurement")
+            self.logger.error("Critical error: %s - stopping measurement", error_type.value)
             self._finished.set()  # Signal measurement to stop
         elif error_type == ArduinoErrorType.I2C_TIMEOUT:
             recent_i2c_errors = [e for e in self._arduino_errors[-5:] 
                                if e['error_type'] == ArduinoErrorType.I2C_TIMEOUT]
             if len(recent_i2c_errors) >= 3:
-                print(">>> Multiple I2C timeouts detected - sensor may be failing")
+                self.logger.warning("Multiple I2C timeouts detected - sensor may be failing")
                 self._critical_error_occurred = True
 
     def _on_reading(self, force, step_pos):
         """Called ~10 Hz by the ArduinoForceController.
         Logs all force and deflection readings to capture the full yield curve.
         """
-        ts = datetime.now().isoformat()
+        ts = time.time()  # the row is formatted when it is written
         defl = step_pos / STEPS_PER_MM
+        rows = None
         with self._lock:
-            self._csv_writer.writerow([ts, f"{force:.3f}", f"{defl:.4f}"])
+            n = self._row_count
+            self._row_buf[n] = ts, force, defl
+            n += 1
+            if n == CSV_WRITE_BATCH:
+                rows = self._row_buf.tolist()
+                n = 0
+            self._row_count = n
+        if rows:
+            self._write_rows(rows)
         # Detect initial arrival at target and schedule
         # measurement-phase logging
         if (not self._meas_started.is_set() and
                 abs(force - TARGET_FORCE) < 1.1):
-            print(f">>> Target force {TARGET_FORCE:.1f} N reached! "
-                  f"Starting measurement in {SETTLE_SECONDS}s...")
+            self.logger.info("Target force %.1f N reached! Starting measurement in %ss...",
+                             TARGET_FORCE, SETTLE_SECONDS)
             self._meas_started.set()
             t = threading.Timer(SETTLE_SECONDS, self._start_logging)
             t.daemon = True
@@ -128,68 +212,84 @@ class MeasurementProtocol:
 
     def _start_logging(self):
         """Turn on CSV logging for the next MEASURE_TIME seconds."""
+        # Start error.log afresh; the loggers' writer threads do the cut after
+        # writing out what was queued, so no older lines follow it
         try:
-            sys.stdout.log_file.seek(0)
-            sys.stdout.log_file.truncate()
-            sys.stderr.log_file.seek(0)
-            sys.stderr.log_file.truncate()
+            for stream in (sys.stdout, sys.stderr):
+                stream.clear()
         except Exception as e:
-            print(f"Error clearing log file: {e}")
-        with self._lock:
-            self._logging_active = True
+            self.logger.warning("Error clearing log file: %s", e)
+        self._logging_active = True
         # schedule stop
         t = threading.Timer(MEASURE_TIME, self._stop_logging)
         t.daemon = True
         t.start()
-        print(f">>> Logging CSV for {MEASURE_TIME} s ...")
+        self.logger.info("Logging CSV for %s s ...", MEASURE_TIME)
         # Trigger external measurement callback if provided
         if self._on_measurement_start:
-            print(">>> Starting NanoVNA measurement...")
+            self.logger.info("Starting NanoVNA measurement...")
             # start VNA measurement in a separate thread
             vna_thread = threading.Thread(target=self._on_measurement_start)
             vna_thread.daemon = True
             vna_thread.start()
             self._vna_thread = vna_thread
         else:
-            print(">>> No NanoVNA callback provided")
+            self.logger.info("No NanoVNA callback provided")
 
     def _stop_logging(self):
-        with self._lock:
-            self._logging_active = False
-        print("<<< Measurement window complete. CSV logging stopped.")
-        # Wait until Arduino is homed before signaling finished
+        self._logging_active = False
+        self.logger.info("Measurement window complete. CSV logging stopped.")
+        # Wait until Arduino is homed before signaling finished. Error lines
+        # wake the wait straight away; the other checks run every 0.5 s
+        self._homed.clear()
         start_time = time.time()
         while time.time() - start_time < ARDUINO_HOMING_TIMEOUT_SECONDS:
             if self.stop_event and self.stop_event.is_set():
-                print(">>> Stop event detected in _stop_logging. Aborting homing wait.")
+                self.logger.info("Stop event detected in _stop_logging. Aborting homing wait.")
                 break
             
             # Check for critical errors
             if self._critical_error_occurred:
-                print(">>> Critical error detected - aborting homing wait")
+                self.logger.warning("Critical error detected - aborting homing wait")
                 break
                 
             last = self.ard.get_last_reading()
             # Check for valid completion signals (removed CONNECTION_LOST from here)
             if (last.startswith("S0") or last == "FAIL" or 
                 last in ["FORCEERROR", "I2CTIMEOUT"]):
-                print(f">>> Arduino signal received: {last}")
+                self.logger.info("Arduino signal received: %s", last)
                 break
             
             # Check if Arduino is still connected but just finished
             if (self.ard.is_measurement_likely_complete() and
                 time.time() - start_time > 5):  # Give some time for normal completion
-                print(">>> Arduino appears to have completed measurement normally")
+                self.logger.info("Arduino appears to have completed measurement normally")
+                break
+
+            if self._homed.wait(0.5):
+                self.logger.info("Arduino signal received: %s", self._homed_signal)
                 break
-                
-            time.sleep(0.5)
         else:
-            print(
-                f"<<< WARNING: Arduino did not send expected signal "
-                f"within {ARDUINO_HOMING_TIMEOUT_SECONDS} seconds."
-            )
+            self.logger.warning("Arduino did not send expected signal within %s seconds.",
+                                ARDUINO_HOMING_TIMEOUT_SECONDS)
         self._finished.set()
 
+    def _write_rows(self, rows):
+        """Write buffered (epoch seconds, force, deflection) rows to the CSV."""
+        fromtimestamp = datetime.fromtimestamp
+        self._csv_writer.writerows(
+            (fromtimestamp(ts).isoformat(), f"{force:.3f}", f"{defl:.4f}")
+            for ts, force, defl in rows
+        )
+
+    def _flush_rows(self):
+        """Write readings still held in the row buffer to the CSV."""
+        with self._lock:
+            rows = self._row_buf[:self._row_count].tolist()
+            self._row_count = 0
+        if rows:
+            self._write_rows(rows)
+
     def get_measurement_success(self):
         """Check if the measurement completed successfully"""
         return (self._finished.is_set() and self._meas_started.is_set() and 
@@ -212,6 +312,7 @@ class MeasurementProtocol:
         # reset the state machine so we can measure again
         self._meas_started.clear()
         self._finished.clear()
+        self._homed.clear()
         self._logging_active = False
         self._arduino_errors.clear()
         self._critical_error_occurred = False
@@ -219,65 +320,78 @@ class MeasurementProtocol:
 
         try:
             start_time = time.time()
-            print(f">>> Sending MOVETOFORCE {TARGET_FORCE:.2f} {HOLD_SECONDS}")
+            self.logger.info("Sending MOVETOFORCE %.2f %s", TARGET_FORCE, HOLD_SECONDS)
             self.ard.move_to_force(TARGET_FORCE, HOLD_SECONDS)
-            print(f">>> Command sent successfully, waiting for Arduino response...")
+            self.logger.info("Command sent successfully, waiting for Arduino response...")
 
-            # wait until measurement complete or Arduino goes home or critical error
-            while not self._finished.is_set():
+            # wait until measurement complete or Arduino goes home or critical error;
+            # the wait returns as soon as _finished is set, the timeout only
+            # paces the stop and error checks
+            while not self._finished.wait(0.5):
                 if self.stop_event and self.stop_event.is_set():
-                    print(">>> Stop event detected in MeasurementProtocol.run(). Aborting.")
+                    self.logger.info("Stop event detected in MeasurementProtocol.run(). Aborting.")
                     self._finished.set()
                     break
                 
                 # Check for critical errors
                 if self._critical_error_occurred:
-                    print(">>> Critical Arduino error detected. Stopping measurement.")
+                    self.logger.error("Critical Arduino error detected. Stopping measurement.")
                     break
-                    
-                time.sleep(0.5)
 
             # Notify end of run
             if self._critical_error_occurred:
-                print(">>> Measurement ended due to critical error")
+                self.logger.warning("Measurement ended due to critical error")
             else:
-                print("Arduino returned home or measurement complete.")
+                self.logger.info("Arduino returned home or measurement complete.")
             
             elapsed = time.time() - start_time
-            print(f">>> Total run duration: {elapsed:.2f} s", flush=True)
+            self.logger.info("Total run duration: %.2f s", elapsed)
             
             # Print error summary if errors occurred
             error_summary = self.get_error_summary()
             if error_summary:
-                print(f">>> Errors during measurement: {error_summary['total_errors']} total, "
-                      f"Critical: {error_summary['critical_error']}")
-                print(f">>> Error types: {', '.join(error_summary['error_types'])}")
+                self.logger.warning("Errors during measurement: %s total, Critical: %s",
+                                    error_summary['total_errors'], error_summary['critical_error'])
+                self.logger.warning("Error types: %s", ", ".join(error_summary['error_types']))
                 
         finally:
-            self.ard.close()
+            self.ard.close()  # stops the read thread, so no more readings arrive
+            self._flush_rows()
             self._csv_file.close()
 
+    def get_sweep_arrays(self):
+        """Return (force_N, deflection_mm) arrays of the readings logged to the CSV.
+
+        Same values plot_force_deflection reads back from the file, without
+        the round trip through CSV and pandas.
+        """
+        force, steps = self.ard.get_sweep_arrays()
+        return force, np.abs(steps / STEPS_PER_MM)
+
     def close(self):
         """Explicitly close Arduino and CSV resources."""
         self.ard.close()
-        self._csv_file.close()
+        if not self._csv_file.closed:
+            self._flush_rows()
+            self._csv_file.close()
 
 def plot_force_deflection(
     csv_filename=CSV_FILENAME, zero_distance_mm=None, ax_force=None, ax_s21=None
 ):
     """Read force and deflection data from CSV and plot."""
-    forces, deflections, timestamps = [], [], []
     try:
-        with open(csv_filename, newline="") as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                forces.append(float(row["force_N"]))
-                deflections.append(abs(float(row["deflection_mm"])))
-                timestamps.append(row["timestamp"])
+        df = pd.read_csv(
+            csv_filename,
+            usecols=["timestamp", "force_N", "deflection_mm"],
+            dtype={"force_N": np.float64, "deflection_mm": np.float64},
+            parse_dates=["timestamp"],
+        )
     except (IOError, KeyError, ValueError) as error:
         print(f"Error reading CSV for plotting: {error}")
         # Return empty DataFrame and None for axes if an error occurs
         return None, None, pd.DataFrame(columns=['timestamp', 'force_N', 'deflection_mm'])
+    df["deflection_mm"] = df["deflection_mm"].abs()
+    forces = df["force_N"].to_numpy()
 
     # --- Create Figure / Use existing axes ---
     if ax_force is None or ax_s21 is None:
@@ -285,16 +399,18 @@ def plot_force_deflection(
         return_fig = fig
     else:
         return_fig = None
-        ax_force.clear()
-        ax_s21.clear()
+        # Keep the line artists for replot(); only the previous notes go
+        for text in [*ax_force.texts, *ax_s21.texts]:
+            text.remove()
 
     # --- Top-right: Timestamp vs Force (now ax_force) ---
     try:
-        times = mdates.datestr2num(timestamps)
-        ax_force.plot(times, forces, marker=".", linestyle="-")
+        times = mdates.date2num(df["timestamp"].to_numpy())
+        replot(ax_force, times, forces, marker=".", linestyle="-", color="C0")
         ax_force.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M:%S'))
         ax_force.set_xlabel("Timestamp")
     except Exception:
+        ax_force.clear()  # drop the date formatter along with the old line
         ax_force.plot(range(len(forces)), forces, marker=".", linestyle="-")
         ax_force.set_xlabel("Sample index")
     ax_force.set_ylabel("Force (N)")
@@ -305,27 +421,18 @@ def plot_force_deflection(
     s2p_filename = csv_filename.replace("fd_", "sweep_").replace(
         ".csv", ".s2p"
     )
+    s21_plotted = False
     if os.path.exists(s2p_filename):
-        freq, s21_db = [], []
         try:
-            with open(s2p_filename, 'r') as s2p_file:
-                for line in s2p_file:
-                    if line.strip() and not line.startswith(('!', '#')):
-                        parts = line.split()
-                        if len(parts) >= 5:
-                            f_val = float(parts[0])
-                            s21_real = float(parts[3])
-                            s21_imag = float(parts[4])
-                            s21 = max(
-                                np.sqrt(s21_real**2 + s21_imag**2), 1e-12
-                            )
-                            freq.append(f_val / 1000)  # to kHz
-                            s21_db.append(20 * np.log10(s21))
-            if freq and s21_db:
-                ax_s21.plot(freq, s21_db, marker='.', linestyle='-')
-        except (ValueError, IndexError):
-            pass  # Ignore malformed lines
-            
+            freq, s21_db = read_s21_db(s2p_filename)
+            if len(freq):
+                replot(ax_s21, freq, s21_db, marker='.', linestyle='-', color='C0')
+                s21_plotted = True
+        except ValueError:
+            pass  # Unreadable file: leave the plot empty
+    if not s21_plotted:
+        ax_s21.clear()
+
     ax_s21.set_xlabel("Frequency (kHz)")
     ax_s21.set_ylabel("S21 (dB)")
     ax_s21.set_title("NanoVNA Power Spectrum (S21)")
@@ -334,14 +441,14 @@ def plot_force_deflection(
         ax_s21.text(0.5, 0.5, "s2p file not found\nor has no data", ha="center",
                  va="center", transform=ax_s21.transAxes)
 
-    plt.tight_layout()
+    # Embedded axes are laid out by their owner (the GUI does this once)
+    if return_fig:
+        return_fig.tight_layout()
     # Depending on whether new figure was created or existing axes were used
     if return_fig:
-        return return_fig, ax_force, pd.DataFrame({'timestamp': timestamps, 'force_N': forces,
-                                   'deflection_mm': deflections})
+        return return_fig, ax_force, df
     else:
-        return None, None, pd.DataFrame({'timestamp': timestamps, 'force_N': forces,
-                                   'deflection_mm': deflections})
+        return None, None, df
 
 if __name__ == "__main__":
     # Run a short dummy measurement to clear any state issues (non-blocking)
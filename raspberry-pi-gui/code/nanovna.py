@@ -9,6 +9,7 @@ import logging
 import concurrent.futures
 from datetime import datetime
 
+import numpy as np
 import pynanovna
 from usb_controller_subprocess import USBController, USBControllerError
 
@@ -38,15 +39,20 @@ class NanoVnaController:
             "%(asctime)s - %(levelname)s - %(message)s",
             "%Y-%m-%d %H:%M:%S"
         )
-        for handler in (
+        self._handlers = (
             logging.StreamHandler(),
             logging.FileHandler(log_file)
-        ):
+        )
+        for handler in self._handlers:
             handler.setFormatter(fmt)
             self.logger.addHandler(handler)
 
         # —— USB Controller for manual reboot ——
         self.usb_ctrl = USBController(hub_location=hub_location, port=hub_port)
+        # Runs recovery attempts so they can be timed out; kept for reuse
+        self._recovery_exec = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="vna-recover"
+        )
         # self.usb_ctrl.power_cycle(off_duration=5.0)
 
         # —— Connect & configure VNA ——
@@ -63,6 +69,30 @@ class NanoVnaController:
         # —— Prepare output folder ——
         os.makedirs(self.output_dir, exist_ok=True)
 
+    def is_connected(self) -> bool:
+        """True if the VNA is still connected (no sweep is run)."""
+        try:
+            return self.vna.is_connected()
+        except Exception:
+            return False
+
+    def close(self):
+        """Disconnect from the NanoVNA and detach this instance's log handlers."""
+        try:
+            self.vna.kill()
+        except Exception:
+            pass
+        self._recovery_exec.shutdown(wait=False, cancel_futures=True)
+        for handler in self._handlers:
+            self.logger.removeHandler(handler)
+            handler.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
     def _connect_vna(self, initial: bool = False):
         """(Re)connect to the NanoVNA and load calibration."""
         msg = "Initial connection to" if initial else "Reconnection to"
@@ -87,31 +117,48 @@ class NanoVnaController:
 
     def _write_s2p(self, fname, freq, s11, s21):
         """Write Touchstone .s2p file."""
-        with open(fname, "w") as f:
-            f.write("# Hz S RI R 50\n")
-            for hz, c11, c21 in zip(freq, s11, s21):
-                f.write(
-                    f"{int(hz)} "
-                    f"{c11.real:.6e} {c11.imag:.6e} "
-                    f"{c21.real:.6e} {c21.imag:.6e} "
-                    f"{c21.real:.6e} {c21.imag:.6e} "
-                    f"{c11.real:.6e} {c11.imag:.6e}\n"
-                )
+        s11 = np.asarray(s11)
+        s21 = np.asarray(s21)
+        # S12 and S22 are not measured; S21 and S11 are reused for them
+        rows = np.column_stack((
+            freq, s11.real, s11.imag, s21.real, s21.imag,
+            s21.real, s21.imag, s11.real, s11.imag,
+        ))
+        np.savetxt(fname, rows, fmt="%d" + " %.6e" * 8,
+                   header="Hz S RI R 50", comments="# ")
 
     def _reinitialize_vna_with_timeout(self, max_retries=3, timeout=10):
-        """Attempt reinitialization (with USB power-cycle) under a timeout."""
+        """Attempt reinitialization (with USB power-cycle) under a timeout.
+
+        Attempts never overlap, and none is left running or queued when
+        this returns: an attempt still busy after its timeout is waited on
+        again instead of starting another one behind it.
+        """
+        future = None
         for attempt in range(1, max_retries + 1):
             self.logger.info(f"Recovery attempt {attempt}/{max_retries}")
-            with concurrent.futures.ThreadPoolExecutor(
-                max_workers=1
-            ) as executor:
-                future = executor.submit(self._reinitialize_vna_once)
-                try:
-                    if future.result(timeout=timeout):
-                        return True
-                except concurrent.futures.TimeoutError:
-                    self.logger.error("Reinit timed out.")
+            if future is None or future.done():
+                if future is not None and not future.cancelled() and future.result():
+                    return True  # the timed-out attempt got there after all
+                future = self._recovery_exec.submit(self._reinitialize_vna_once)
+            else:
+                self.logger.warning("Previous attempt still running; waiting on it.")
+            try:
+                if future.result(timeout=timeout):
+                    return True
+            except concurrent.futures.TimeoutError:
+                self.logger.error("Reinit timed out.")
+                future.cancel()  # only succeeds if it has not started yet
+            except concurrent.futures.CancelledError:
+                pass
             time.sleep(1)
+        if future is not None and not future.done():
+            # It owns self.vna and the hub port until it ends
+            self.logger.warning("Waiting for the last recovery attempt to finish.")
+            try:
+                return bool(future.result())
+            except concurrent.futures.CancelledError:
+                pass
         return False
 
     def _reinitialize_vna_once(self):
@@ -150,7 +197,12 @@ class NanoVnaController:
         Returns True if successful, False otherwise.
         """
         start_hz, stop_hz = self.full_range
-        freqs_all, s11_all, s21_all = [], [], []
+        # Segments are copied into preallocated arrays as they arrive
+        total = segments * points_per_segment
+        freqs_all = np.empty(total)
+        s11_all = np.empty(total, dtype=np.complex128)
+        s21_all = np.empty(total, dtype=np.complex128)
+        filled = 0
         bounds = [
             start_hz + i * (stop_hz - start_hz) / segments
             for i in range(segments + 1)
@@ -170,9 +222,11 @@ class NanoVnaController:
             for retry in range(1, 4):
                 try:
                     s11, s21, freq = self.vna.sweep()
-                    freqs_all.extend(freq)
-                    s11_all.extend(s11)
-                    s21_all.extend(s21)
+                    end = filled + len(freq)
+                    freqs_all[filled:end] = freq
+                    s11_all[filled:end] = s11
+                    s21_all[filled:end] = s21
+                    filled = end
                     segment_done = True
                     break
                 except Exception as e:
@@ -198,7 +252,9 @@ class NanoVnaController:
             self.output_dir,
             f"sweep_{timestamp}.s2p"
         )
-        self._write_s2p(fname, freqs_all, s11_all, s21_all)
+        self._write_s2p(
+            fname, freqs_all[:filled], s11_all[:filled], s21_all[:filled]
+        )
         self.logger.info(f"Sweep saved: {fname}")
         return True
 
@@ -208,8 +264,9 @@ class NanoVnaController:
             if not self.vna.is_connected():
                 self.logger.warning("VNA disconnected.")
                 return False
-            # try a zero-point sweep
-            self.vna.set_sweep(*self.sweep_range)
+            # A two-point sweep is enough to show the VNA answers;
+            # sweep_and_save sets its own range for every segment
+            self.vna.set_sweep(*self.full_range, 2)
             self.vna.sweep()
             return True
         except Exception:
@@ -0,0 +1,36 @@
+"""Regression test for the NumPy smoothing in diameter_extractor.
+
+The reference indices were produced by the scipy.signal.savgol_filter based
+implementation this module replaced. Forces are rounded to 3 decimals like
+the firmware's; on coarser data gradient ties can resolve differently.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from diameter_extractor import DiameterExtractor
+
+
+def _sweep(n, rise, fall, wobble):
+    """Deterministic press-and-release sweep with 3-decimal force values."""
+    i = np.arange(n)
+    t = i / (n - 1)
+    force = (9 / (1 + np.exp(-(t - rise) * 60)) / (1 + np.exp((t - fall) * 60))
+             + 0.05 * np.sin(i * wobble) + 0.1)
+    return np.round(force, 3), np.round((i % 3) / 100, 3)
+
+
+@pytest.mark.parametrize("sweep, step_idx, flush_idx, relative_flush_idx", [
+    ((25, 0.3, 0.7, 1.1), 7, 7, 17),  # shorter than the default window
+    ((600, 0.1, 0.5, 0.45), 61, 302, 297),
+    ((900, 0.15, 0.6, 0.7), 135, 356, 543),
+])
+def test_matches_scipy_reference(sweep, step_idx, flush_idx, relative_flush_idx):
+    force, deflection = _sweep(*sweep)
+    extractor = DiameterExtractor()
+    frame = pd.DataFrame({'force_N': force, 'deflection_mm': deflection})
+
+    assert extractor.get_step_flush_indices(frame) == (step_idx, flush_idx, relative_flush_idx)
+    diameter, flags, _ = extractor.diameter_from_arrays(force, deflection)
+    assert diameter == pytest.approx(flush_idx * extractor.calibration_scaling)
+    assert flags == ['NOT_CALIBRATED']
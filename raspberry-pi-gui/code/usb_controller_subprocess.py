@@ -6,10 +6,12 @@ Turn a specific port on/off on a UUGear MEGA4 hub by invoking the uhubctl binary
 """
 
 import logging
+import shutil
 import subprocess
-import time
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
 
 class USBControllerError(Exception):
     """Raised when uhubctl fails to run or returns an error."""
@@ -26,59 +28,60 @@ class USBController:
         """
         self.hub_location = hub_location
         self.port = port
-        logging.basicConfig(
-            level=logging.INFO,
-            format="%(asctime)s %(levelname)s: %(message)s",
-            datefmt="%Y-%m-%d %H:%M:%S",
-        )
+        # Built once with absolute binary paths, so each call skips the PATH search
+        self._cmd = [
+            # -n: fail at once instead of waiting for a password (see README)
+            shutil.which("sudo") or "sudo", "-n",
+            shutil.which("uhubctl") or "uhubctl",
+            "-l", self.hub_location,
+            "-p", str(self.port),
+        ]
 
-    def _run_uhubctl(self, action: int):
+    def _run_uhubctl(self, action, *args: str, timeout: float = 10):
         """
         Invoke the uhubctl binary.
-        :param action: 0 to turn off, 1 to turn on
+        :param action: 0 to turn off, 1 to turn on, or "cycle"
+        :param args: Extra uhubctl arguments (e.g. the cycle delay)
+        :param timeout: Seconds to wait for uhubctl to finish
         :raises USBControllerError: if the command fails
         """
-        cmd = [
-            "sudo", "uhubctl",
-            "-l", self.hub_location,
-            "-p", str(self.port),
-            "-a", str(action),
-        ]
-        logging.info(f"Running: {' '.join(cmd)}")
+        cmd = [*self._cmd, "-a", str(action), *args]
+        logger.info("Running: %s", " ".join(cmd))
         try:
             result = subprocess.run(
                 cmd,
                 check=True,
                 capture_output=True,
                 text=True,
-                timeout=10
+                timeout=timeout
             )
-            logging.info(f"uhubctl output: {result.stdout.strip()}")
+            logger.info("uhubctl output: %s", result.stdout.strip())
         except subprocess.CalledProcessError as e:
             msg = f"uhubctl exited {e.returncode}: {e.stderr.strip()}"
-            logging.error(msg)
+            logger.error(msg)
             raise USBControllerError(msg)
         except Exception as e:
             msg = f"Error running uhubctl: {e}"
-            logging.error(msg)
+            logger.error(msg)
             raise USBControllerError(msg)
 
     def power_cycle(self, off_duration: float = 5.0):
         """
         Turn off the port, wait, then turn it back on.
+        uhubctl does the off/wait/on sequence itself, in a single call.
         :param off_duration: Seconds to keep the port off
         """
-        logging.info(f"Powering OFF port {self.port}")
-        self._run_uhubctl(action=0)
-
-        logging.info(f"Sleeping for {off_duration} seconds")
-        time.sleep(off_duration)
-
-        logging.info(f"Powering ON port {self.port}")
-        self._run_uhubctl(action=1)
+        logger.info("Power cycling port %s (%s seconds off)", self.port, off_duration)
+        self._run_uhubctl("cycle", "-d", f"{off_duration:g}", timeout=off_duration + 10)
 
 
 if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s: %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+
     # CONFIGURE THESE
     HUB_LOCATION = "1-1.2"   # e.g. from `sudo uhubctl` scan
     PORT_NUMBER  = 1         # the port you want to cycle
@@ -87,7 +90,7 @@ if __name__ == "__main__":
     controller = USBController(hub_location=HUB_LOCATION, port=PORT_NUMBER)
     try:
         controller.power_cycle(off_duration=OFF_TIME_SEC)
-        logging.info("Power cycle completed successfully.")
+        logger.info("Power cycle completed successfully.")
     except USBControllerError as err:
-        logging.error(f"Power cycle failed: {err}")
+        logger.error("Power cycle failed: %s", err)
         exit(1)